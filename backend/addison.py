@@ -1,13 +1,30 @@
+import asyncio
+from typing import List
+
 from database import Article, Database
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_openai import ChatOpenAI
-from prompts import ADDISON_FEEDBACK_PROMPT, ADDISON_INIT_PROMPT
+from prompts import ADDISON_FEEDBACK_PROMPT, ADDISON_INIT_PROMPT, ADDISON_TITLES_PROMPT
+from pydantic import BaseModel, Field
+from title_index import title_key
+
+
+class TitleVerdict(BaseModel):
+    """Addison's verdict on one proposed title."""
+    title: str = Field(..., description="The proposed title, exactly as given.")
+    feedback: str = Field(..., description='"Approval." or "Veto." followed by the reasons, as for a written article.')
+
+
+class TitleVerdicts(BaseModel):
+    """Give a verdict on every proposed article title."""
+    verdicts: List[TitleVerdict] = Field(..., description="One verdict per proposed title, in the order given.")
 
 
 class Addison:
     def __init__(self, model_name="gpt-4o-mini"):
         super().__init__()
         self.llm = ChatOpenAI(model=model_name)
+        self.title_llm = self.llm.bind_tools([TitleVerdicts], tool_choice="any")
 
     def make_prompt_memory(self, article: Article, search_result):
         return [
@@ -20,3 +37,48 @@ class Addison:
         prompt_memory = self.make_prompt_memory(article, search_result)
         return self.llm.invoke(prompt_memory).content
 
+    async def awrite_feedback(self, database: Database, article: Article) -> str:
+        # query_titles may wait on an embedding request, so keep it off the event loop
+        search_result = await asyncio.to_thread(database.query_titles, article.title)
+        prompt_memory = self.make_prompt_memory(article, search_result)
+        return (await self.llm.ainvoke(prompt_memory)).content
+
+    def make_titles_memory(self, database: Database, titles: List[str]):
+        candidates = [(title, database.query_titles(title)) for title in titles]
+        return [
+            SystemMessage(content=ADDISON_INIT_PROMPT),
+            HumanMessage(content=ADDISON_TITLES_PROMPT(candidates)),
+        ]
+
+    @staticmethod
+    def read_verdicts(response, titles: List[str]) -> dict[str, str]:
+        """
+        Matches the verdicts to `titles`: by title_key, since the echoed titles
+        often differ in case or punctuation, and otherwise by position. Titles
+        without a verdict are missing.
+        """
+        verdicts = []
+        for call in response.tool_calls:
+            if call["name"] == "TitleVerdicts":
+                verdicts = call["args"]["verdicts"]
+                break
+        by_key = {title_key(title): title for title in titles}
+        matched, unmatched = {}, []
+        for i, verdict in enumerate(verdicts):
+            title = by_key.get(title_key(verdict.get("title", "")))
+            if title is None or title in matched:
+                unmatched.append(i)
+            else:
+                matched[title] = verdict["feedback"]
+        for i in unmatched:
+            if i < len(titles) and titles[i] not in matched:
+                matched[titles[i]] = verdicts[i]["feedback"]
+        return matched
+
+    def review_titles(self, database: Database, titles: List[str]) -> dict[str, str]:
+        """Feedback on several proposed titles in one call, keyed by title; titles she skipped are missing."""
+        return self.read_verdicts(self.title_llm.invoke(self.make_titles_memory(database, titles)), titles)
+
+    async def areview_titles(self, database: Database, titles: List[str]) -> dict[str, str]:
+        prompt_memory = await asyncio.to_thread(self.make_titles_memory, database, titles)
+        return self.read_verdicts(await self.title_llm.ainvoke(prompt_memory), titles)
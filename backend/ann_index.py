@@ -0,0 +1,204 @@
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# Nearest-neighbour indices over row-normalized vectors (dot product = cosine
+# similarity). Rows are identified by their insertion position, and every index
+# implements `add(vectors)` and `search(queries, k) -> (similarities, ids)`,
+# where missing neighbours are reported with id -1.
+
+
+def top_k(scores: np.ndarray, ids: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Best `k` entries per row of `scores`, sorted by descending score."""
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, part, axis=1)
+        ids = np.take_along_axis(ids, part, axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    scores = np.take_along_axis(scores, order, axis=1)
+    ids = np.take_along_axis(ids, order, axis=1)
+    if scores.shape[1] < k:
+        pad = k - scores.shape[1]
+        scores = np.pad(scores, ((0, 0), (0, pad)), constant_values=-np.inf)
+        ids = np.pad(ids, ((0, 0), (0, pad)), constant_values=-1)
+    return scores, ids
+
+
+class VectorBuffer:
+    """
+    Rows appended to a preallocated float32 matrix whose capacity doubles when
+    it is full, so adding n rows one batch at a time copies O(n) rows in
+    total instead of the whole matrix on every add.
+    """
+
+    def __init__(self, dim: int, initial_capacity=1024):
+        self.buffer = np.zeros((initial_capacity, dim), dtype=np.float32)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def rows(self) -> np.ndarray:
+        """A view of the filled rows."""
+        return self.buffer[:self.size]
+
+    def append(self, vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.size + len(vectors) > len(self.buffer):
+            grown = np.zeros((max(2 * len(self.buffer), self.size + len(vectors)), self.buffer.shape[1]), dtype=np.float32)
+            grown[:self.size] = self.rows
+            self.buffer = grown
+        self.buffer[self.size:self.size + len(vectors)] = vectors
+        self.size += len(vectors)
+
+
+class ExactIndex:
+    """Brute force search, one matrix multiply against every stored vector."""
+
+    def __init__(self, dim: int):
+        self.stored = VectorBuffer(dim)
+
+    def __len__(self):
+        return len(self.stored)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self.stored.rows
+
+    def add(self, vectors: np.ndarray):
+        self.stored.append(vectors)
+
+    def search(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        scores = queries @ self.vectors.T
+        ids = np.broadcast_to(np.arange(len(self.vectors)), scores.shape)
+        return top_k(scores, ids, k)
+
+
+class IVFIndex:
+    """
+    NumPy-only inverted file index.
+
+    Vectors are bucketed by their nearest k-means centroid and a query only
+    scans the `n_probe` buckets whose centroids are closest to it, so search
+    cost grows with about sqrt(n) instead of n. Until there are enough vectors
+    to train the centroids, and again whenever the index has grown 4x since
+    the last training, the buckets are rebuilt from scratch.
+    """
+
+    def __init__(self, dim: int, n_probe=8, lists_per_sqrt=1.0, train_iterations=10, min_train_size=1024, seed=0):
+        self.stored = VectorBuffer(dim)
+        self.n_probe = n_probe
+        self.lists_per_sqrt = lists_per_sqrt
+        self.train_iterations = train_iterations
+        self.min_train_size = min_train_size
+        self.rng = np.random.default_rng(seed)
+
+        self.centroids = None
+        self.lists: list[np.ndarray] = []
+        self.trained_size = 0
+
+    def __len__(self):
+        return len(self.stored)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self.stored.rows
+
+    def train(self):
+        n_lists = max(1, int(self.lists_per_sqrt * np.sqrt(len(self.vectors))))
+        centroids = self.vectors[self.rng.choice(len(self.vectors), n_lists, replace=False)]
+        for _ in range(self.train_iterations):
+            assignment = np.argmax(self.vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, self.vectors)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # empty lists keep their old centroid
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+        self.centroids = centroids
+        assignment = np.argmax(self.vectors @ centroids.T, axis=1)
+        self.lists = [np.flatnonzero(assignment == i) for i in range(n_lists)]
+        self.trained_size = len(self.vectors)
+
+    def add(self, vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        start = len(self.stored)
+        self.stored.append(vectors)
+        if len(self.vectors) < self.min_train_size:
+            return
+        if self.centroids is None or len(self.vectors) >= 4 * self.trained_size:
+            self.train()
+            return
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        for i in np.unique(assignment):
+            self.lists[i] = np.concatenate([self.lists[i], start + np.flatnonzero(assignment == i)])
+
+    def search(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        if self.centroids is None:
+            scores = queries @ self.vectors.T
+            return top_k(scores, np.broadcast_to(np.arange(len(self.vectors)), scores.shape), k)
+
+        n_probe = min(self.n_probe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        # scan list by list, so each list is one matrix multiply for all queries probing it
+        for list_id in np.unique(probes):
+            ids = self.lists[list_id]
+            if len(ids) == 0:
+                continue
+            query_rows = np.flatnonzero((probes == list_id).any(axis=1))
+            scores = queries[query_rows] @ self.vectors[ids].T
+            merged_scores = np.hstack([best_scores[query_rows], scores])
+            merged_ids = np.hstack([best_ids[query_rows], np.broadcast_to(ids, scores.shape)])
+            best_scores[query_rows], best_ids[query_rows] = top_k(merged_scores, merged_ids, k)
+        return best_scores, best_ids
+
+
+class HnswIndex:
+    """Graph based search through the optional `hnswlib` package."""
+
+    def __init__(self, dim: int, ef=64, M=16, ef_construction=200, initial_capacity=1024):
+        if hnswlib is None:
+            raise ImportError("The 'hnsw' title index needs the hnswlib package (pip install hnswlib)")
+        self.index = hnswlib.Index(space="ip", dim=dim)
+        self.index.init_index(max_elements=initial_capacity, M=M, ef_construction=ef_construction)
+        self.index.set_ef(ef)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) == 0:
+            return
+        if self.count + len(vectors) > self.index.get_max_elements():
+            self.index.resize_index(max(2 * self.index.get_max_elements(), self.count + len(vectors)))
+        self.index.add_items(vectors, np.arange(self.count, self.count + len(vectors)))
+        self.count += len(vectors)
+
+    def search(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        n = min(k, self.count)
+        if n == 0:
+            return top_k(np.zeros((len(queries), 0), np.float32), np.zeros((len(queries), 0), np.int64), k)
+        ids, distances = self.index.knn_query(queries, k=n)
+        # hnswlib reports inner product distances as 1 - similarity
+        return top_k((1 - distances).astype(np.float32), ids.astype(np.int64), k)
+
+
+INDEX_KINDS = {
+    "exact": ExactIndex,
+    "ivf": IVFIndex,
+    "hnsw": HnswIndex,
+}
+
+
+def make_index(kind: str, dim: int, **kwargs):
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown title index {kind!r}, expected one of {', '.join(INDEX_KINDS)}")
+    return INDEX_KINDS[kind](dim, **kwargs)
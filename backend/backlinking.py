@@ -1,125 +1,799 @@
+from ann_index import ExactIndex, VectorBuffer, make_index
 from database import Article, Database
+from embedding_store import EmbeddingStore
 from secret_keys import *
+from title_trie import TitleAutomaton
 
+import argparse
+import json
 import numpy as np
-import random
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from sentence_transformers import SentenceTransformer
-from functools import cache
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_CACHE_DIR = "embedding_cache"
+BACKLINKING_STATE_DIR = "backlinking_state"
 
 # init database
 
-def cosine_similarity(vec1, vec2):
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    Scale every row of a matrix to unit length, so that a dot product between
+    rows equals their cosine similarity. All-zero rows are left as zeros.
     """
-    Calculate the cosine similarity between two vectors.
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
 
-    Parameters:
-    vec1 (numpy.ndarray): First vector.
-    vec2 (numpy.ndarray): Second vector.
+def available_cpus() -> int:
+    """CPUs this process may run on, which can be fewer than the machine has."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
 
-    Returns:
-    float: Cosine similarity between vec1 and vec2.
-    """
-    dot_product = np.dot(vec1, vec2)
-    norm_vec1 = np.linalg.norm(vec1)
-    norm_vec2 = np.linalg.norm(vec2)
-    return dot_product / (norm_vec1 * norm_vec2)
+def tokenize(sentence: str) -> list[str]:
+    return sentence.replace(".", "").replace("!", "").replace("?", "").replace(",", "").split(" ")
 
-@cache
-def vectorize(sentence, model):
-    embeddings = model.encode(sentence)
-    return np.array(embeddings)
+def phrase_key(phrase: str) -> str:
+    """How a linked phrase is stored, so one phrase never ends up under several keys."""
+    return phrase.lower()
 
-def backlinking_round(database: Database, batch_size=50, debug_print=False):
-    if debug_print:
-        print(f"Starting Backlinking round with {batch_size=}")
-    model = SentenceTransformer("all-MiniLM-L6-v2")
+def bigrams(words: list[str]) -> list[str]:
+    return [f"{word} {next_word}" for word, next_word in zip(words, words[1:])]
 
-    all_articles: list[Article] = database.get_all_articles()
-    random.shuffle(all_articles)
-    all_articles = all_articles[:batch_size]
+class PhraseVectors:
+    """
+    Embeddings of all unique phrases of a round, stored in one shared array.
+    Rows are looked up by phrase, so articles never call the model themselves.
+    """
 
-    articles_map = {a.title: a.content for a in all_articles}
-    article_article_map = {a.title: a for a in all_articles}
+    def __init__(self, phrases: list[str], matrix: np.ndarray, rows: dict[str, int] = None):
+        self.rows = rows if rows is not None else {p: i for i, p in enumerate(phrases)}
+        self.matrix = matrix
 
-    if debug_print:
-        print(f"Loaded {len(all_articles)} articles.")
+    def subset(self, phrases) -> dict[str, int]:
+        """Row numbers of just the given phrases, for handing a part of the array to another process."""
+        return {p: self.rows[p] for p in phrases}
 
-    title_vectors: dict[str, np.array] = {}
-    for i, title in enumerate(articles_map.keys()):
-        title_vectors[title] = vectorize(title, model)
+    def lookup(self, phrases: list[str]) -> np.ndarray:
+        if len(phrases) == 0:
+            return np.zeros((0, self.matrix.shape[1]), dtype=self.matrix.dtype)
+        return self.matrix[[self.rows[p] for p in phrases]]
+
+def encode_phrases(phrases, model, batch_size=256, debug_print=False, store: EmbeddingStore = None) -> PhraseVectors:
+    """
+    De-duplicates `phrases` and encodes them with the model in batches of
+    `batch_size`, instead of one `model.encode` call per phrase. With a `store`,
+    only phrases that were never encoded before are sent to the model.
+    """
+    unique_phrases = list(dict.fromkeys(phrases))
     if debug_print:
-        print("Done with vectorizing the titles.")
-
-    def tokenize(sentence: str) -> list[str]:
-        return sentence.replace(".", "").replace("!", "").replace("?", "").replace(",", "").split(" ")
-
-    article_backlinks: dict[str, list[str]] = {}
-    all_titles = list(articles_map.keys())
-    title_tokenizations = {t: tokenize(t) for t in all_titles}
-    single_word_titles = [t for t in all_titles if len(title_tokenizations[t]) == 1]
-
-    similarity_thresh = 0.8
-
-    def parse_article(title1: str, content: str):
-        words = tokenize(content)
-        backlinks: dict[str, str] = {}
-
-        # find 1 word matches
-        for word in words:
-            word_vec = vectorize(word, model)
-            for title in single_word_titles:
-                if title == title1:
-                    continue
-                title_vec = title_vectors[title]
-                if cosine_similarity(word_vec, title_vec) >= similarity_thresh:
-                    backlinks[word] = title
-
-        # find 2 word matches
-        for word, next_word in zip(words, words[1:]):
-            query = f"{word} {next_word}"
-            query_vec = vectorize(word, model)
-            for title in all_titles:
-                if title == title1:
-                    continue
-                title_vec = title_vectors[title]
-                if cosine_similarity(query_vec, title_vec) >= similarity_thresh:
-                    backlinks[query] = title
-
-        return backlinks
-
-    for i, title in enumerate(articles_map.keys()):
-        content = articles_map[title]
-        backlinks = parse_article(title, content)
-        article_backlinks[title] = backlinks
+        print(f"Encoding {len(unique_phrases)} unique phrases ({len(phrases)} total).")
+
+    def encode(texts):
+        return model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
 
+    if store is None:
+        matrix = encode(unique_phrases)
+    else:
+        matrix = store.encode(unique_phrases, encode)
         if debug_print:
-            print(f"{i + 1} done", end="\r")
+            print(f"Embedding store: {store.hits} hits, {store.misses} misses, {len(store)} stored.")
+    return PhraseVectors(unique_phrases, np.asarray(matrix, dtype=np.float32))
 
-    all_backlinks: dict[Article, tuple[str, str]] = {}
+class TitleMatcher:
+    """
+    Matches candidate vectors against all titles with one matrix multiply.
 
-    for article in all_articles:
-        if article.backlinks == "":
-            continue
-        backlinks = {b.split(":")[0]: b.split(":")[1] for b in article.backlinks.split(",")}
-        all_backlinks[article] = backlinks
+    The title vectors are stacked into a single pre-normalized matrix, so scoring
+    a batch of candidates is `candidates @ titles.T` followed by a vectorized
+    threshold. For every candidate the *last* title (in title order) above the
+    threshold is picked, which is what the old pairwise loop produced since later
+    matches overwrote earlier ones.
 
-    for title in all_titles:
-        article = article_article_map[title]
-        backlinks = {k: article_article_map[t].uid for k, t in article_backlinks[title].items()}
-        if not article in all_backlinks:
-            all_backlinks[article] = {}
-        for k, v in backlinks.items():
-            all_backlinks[article][k] = v
+    For large title sets an approximate nearest-neighbour index ("ivf" or
+    "hnsw", see ann_index.py) can be used instead. `match` then only considers
+    the `top_k` nearest titles of every candidate, which keeps matching
+    sub-linear in the number of titles. "exact" keeps the brute-force path.
+    """
 
-    if debug_print:
-        print("Finished entirely.")
+    def __init__(self, titles: list[str], title_vectors: np.ndarray, similarity_thresh=0.8, index_kind="exact",
+                 top_k=10, normalized=False):
+        dim = np.shape(title_vectors)[-1]
+        self.titles: list[str] = []
+        self.title_matrix = np.zeros((0, dim), dtype=np.float32)
+        self.stored: VectorBuffer = None  # backs title_matrix once titles are added to it
+        self.title_columns: dict[str, int] = {}
+        self.single_word_columns: list[int] = []
+        self.similarity_thresh = similarity_thresh
+        self.top_k = top_k
+        self.index_kind = index_kind
+        self.index = None
+        self.single_word_index = None
+        if index_kind != "exact":
+            self.index = make_index(index_kind, dim)
+            self.single_word_index = make_index(index_kind, dim)
+        self.add_titles(titles, title_vectors, normalized)
+
+    def add_titles(self, titles: list[str], title_vectors: np.ndarray, normalized=False):
+        """
+        Appends titles as new columns, after all existing ones. Already
+        `normalized` vectors of a fresh matcher are used without copying them,
+        which keeps memory-mapped title matrices shared. Otherwise the matrix
+        lives in a VectorBuffer, so adding titles every round copies O(n)
+        rows in total instead of the whole matrix every time.
+        """
+        if len(titles) == 0:
+            return
+        if not normalized:
+            title_vectors = normalize_rows(title_vectors)
+        single_word_rows = []
+        for i, title in enumerate(titles):
+            self.title_columns[title] = len(self.titles)
+            if len(tokenize(title)) == 1:
+                self.single_word_columns.append(len(self.titles))
+                single_word_rows.append(i)
+            self.titles.append(title)
+        if len(self.title_matrix) == 0 and normalized:
+            self.title_matrix = title_vectors
+        else:
+            if self.stored is None:
+                self.stored = VectorBuffer(self.title_matrix.shape[1], max(1024, len(self.title_matrix) + len(titles)))
+                self.stored.append(self.title_matrix)
+            self.stored.append(title_vectors)
+            self.title_matrix = self.stored.rows
+        if self.index is not None:
+            self.index.add(title_vectors)
+            self.single_word_index.add(title_vectors[single_word_rows])
+
+    def scores(self, vectors: np.ndarray) -> np.ndarray:
+        return normalize_rows(vectors) @ self.title_matrix.T
+
+    def best_matches(self, scores: np.ndarray, exclude_title=None, columns=None) -> list:
+        """
+        Returns the matching title per row of `scores` (or None if nothing matched).
+        `columns` restricts the candidate titles to a subset of title indices.
+        """
+        if columns is None:
+            columns = np.arange(len(self.titles))
+        columns = np.asarray(columns, dtype=np.int64)
+        if exclude_title in self.title_columns:
+            columns = columns[columns != self.title_columns[exclude_title]]
+        if len(columns) == 0 or len(scores) == 0:
+            return [None] * len(scores)
+
+        mask = scores[:, columns] >= self.similarity_thresh
+        last = len(columns) - 1 - np.argmax(mask[:, ::-1], axis=1)
+        found = mask.any(axis=1)
+        return [self.titles[columns[j]] if f else None for j, f in zip(last, found)]
+
+    def match(self, vectors: np.ndarray, exclude_title=None, single_word=False) -> list:
+        """
+        Returns the matching title per candidate vector (or None), only looking at
+        single-word titles if `single_word` is set.
+        """
+        if self.index is None:
+            columns = self.single_word_columns if single_word else None
+            return self.best_matches(self.scores(vectors), exclude_title, columns)
+
+        index = self.single_word_index if single_word else self.index
+        if len(vectors) == 0 or len(index) == 0:
+            return [None] * len(vectors)
+        # one extra neighbour so that excluding the article's own title still leaves top_k
+        similarities, ids = index.search(normalize_rows(vectors), self.top_k + 1)
+        if single_word:
+            columns = np.where(ids >= 0, np.asarray(self.single_word_columns)[np.maximum(ids, 0)], -1)
+        else:
+            columns = ids
+        valid = (similarities >= self.similarity_thresh) & (columns >= 0)
+        if exclude_title in self.title_columns:
+            valid &= columns != self.title_columns[exclude_title]
+        last = np.where(valid, columns, -1).max(axis=1)
+        return [self.titles[c] if c >= 0 else None for c in last]
+
+def uncovered_phrases(words: list[str], spans: list[tuple[int, int, str]]) -> tuple[list[str], list[str]]:
+    """Words and bigrams of an article that don't overlap any exact title mention."""
+    covered = [False] * len(words)
+    for start, end, _ in spans:
+        covered[start:end] = [True] * (end - start)
+    words_left = [w for w, c in zip(words, covered) if not c]
+    pairs_left = [f"{words[i]} {words[i + 1]}" for i in range(len(words) - 1) if not (covered[i] or covered[i + 1])]
+    return words_left, pairs_left
+
+def parse_article(matcher: TitleMatcher, phrase_vectors: PhraseVectors, title1: str, words: list[str],
+                  spans: list[tuple[int, int, str]] = ()) -> dict[str, str]:
+    """
+    Returns {phrase_key(phrase): title} for every phrase of an article that links to another title.
+    `spans` are exact title mentions (see TitleAutomaton.find); they become links as
+    they are, and only the words and bigrams outside of them go through embedding
+    similarity.
+    """
+    backlinks: dict[str, str] = {}
+
+    # exact, case-insensitive title mentions
+    for start, end, title in spans:
+        backlinks[phrase_key(" ".join(words[start:end]))] = title
+
+    words, pairs = uncovered_phrases(words, spans)
+    unique_words = list(dict.fromkeys(words))
+    unique_pairs = list(dict.fromkeys(pairs))
+
+    # find 1 word matches
+    single_matches = dict(zip(unique_words, matcher.match(phrase_vectors.lookup(unique_words), title1, single_word=True)))
+    for word in words:
+        if single_matches[word] is not None and phrase_key(word) not in backlinks:
+            backlinks[phrase_key(word)] = single_matches[word]
+
+    # find 2 word matches
+    pair_matches = dict(zip(unique_pairs, matcher.match(phrase_vectors.lookup(unique_pairs), title1)))
+    for pair in pairs:
+        if pair_matches[pair] is not None and phrase_key(pair) not in backlinks:
+            backlinks[phrase_key(pair)] = pair_matches[pair]
+
+    return backlinks
+
+_shard_matchers: dict[str, TitleMatcher] = {}
+
+def parse_shard(spec: dict, rows: dict[str, int], items: list[tuple[str, list[str], list]]) -> dict[str, dict[str, str]]:
+    """
+    Process pool entry point of sharded matching. The title and phrase matrices
+    are memory-mapped from the files named in `spec`, so they are shared through
+    the page cache instead of being pickled to every process. The matcher is
+    built once per process and round.
+    """
+    if spec["title_matrix"] not in _shard_matchers:
+        _shard_matchers.clear()
+        with open(spec["titles"], "r", encoding="utf-8") as file:
+            titles = json.load(file)
+        title_matrix = np.load(spec["title_matrix"], mmap_mode="r")
+        _shard_matchers[spec["title_matrix"]] = TitleMatcher(titles, title_matrix, spec["similarity_thresh"],
+                                                             spec["index_kind"], spec["top_k"], normalized=True)
+    matcher = _shard_matchers[spec["title_matrix"]]
+    phrase_vectors = PhraseVectors([], np.load(spec["phrase_matrix"], mmap_mode="r"), rows)
+    return {title: parse_article(matcher, phrase_vectors, title, words, spans) for title, words, spans in items}
+
+class PhrasePostings:
+    """
+    Inverted index of the articles incremental backlinking has processed, in
+    SQLite, so a rescan for new titles only reads the articles it can change.
+    Per article it keeps the words and bigrams outside exact title mentions,
+    which are the phrases that can link by embedding similarity, and every
+    lower-cased word, to find the articles that mention a new title verbatim.
+    Postings are only ever added, so they may list phrases an article no
+    longer has; that costs a wasted read, never a missed link.
+    """
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS phrases (phrase TEXT, uid TEXT, PRIMARY KEY (phrase, uid)) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS words (word TEXT, uid TEXT, PRIMARY KEY (word, uid)) WITHOUT ROWID;
+            """)
+
+    def is_empty(self) -> bool:
+        return self.connection.execute("SELECT 1 FROM words LIMIT 1").fetchone() is None
+
+    def add(self, entries):
+        """Adds (uid, words, phrases outside exact title mentions) entries in one transaction."""
+        with self.connection:
+            for uid, words, phrases in entries:
+                self.connection.executemany("INSERT OR IGNORE INTO phrases VALUES (?, ?)",
+                                            [(p, str(uid)) for p in set(phrases)])
+                self.connection.executemany("INSERT OR IGNORE INTO words VALUES (?, ?)",
+                                            [(w, str(uid)) for w in {w.lower() for w in words if w != ""}])
+
+    def phrases(self, batch_size=65536):
+        """Streams every distinct phrase, in batches."""
+        cursor = self.connection.execute("SELECT DISTINCT phrase FROM phrases")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if len(rows) == 0:
+                return
+            yield [row[0] for row in rows]
+
+    def with_phrases(self, phrases, chunk_size=500) -> set[str]:
+        """Uids of the articles listing any of `phrases`."""
+        phrases = list(phrases)
+        uids = set()
+        for start in range(0, len(phrases), chunk_size):
+            chunk = phrases[start:start + chunk_size]
+            uids.update(uid for (uid,) in self.connection.execute(
+                f"SELECT DISTINCT uid FROM phrases WHERE phrase IN ({','.join('?' * len(chunk))})", chunk))
+        return uids
+
+    def with_all_words(self, words) -> set[str]:
+        """Uids of the articles containing every one of `words`, ignoring case."""
+        words = sorted({w.lower() for w in words if w != ""})
+        if len(words) == 0:
+            return set()
+        return {uid for (uid,) in self.connection.execute(
+            f"SELECT uid FROM words WHERE word IN ({','.join('?' * len(words))}) GROUP BY uid HAVING COUNT(*) = ?",
+            [*words, len(words)])}
+
+class BacklinkingState:
+    """
+    Persisted progress of incremental backlinking: the `_id` watermark of the
+    last processed article, the title index (one title + uid per line, in
+    column order) and the PhrasePostings of every processed article. Title
+    and phrase vectors live in the embedding store, so loading the state
+    doesn't re-encode anything.
+    """
+
+    def __init__(self, directory=BACKLINKING_STATE_DIR):
+        self.directory = directory
+        self.watermark_path = os.path.join(directory, "watermark.json")
+        self.titles_path = os.path.join(directory, "titles.jsonl")
+
+        self.watermark = None
+        self.titles: list[str] = []
+        self.title_uids: dict[str, str] = {}
+
+        os.makedirs(directory, exist_ok=True)
+        self.postings = PhrasePostings(os.path.join(directory, "postings.db"))
+        if os.path.exists(self.watermark_path):
+            with open(self.watermark_path, "r", encoding="utf-8") as file:
+                self.watermark = json.load(file)["_id"]
+        if os.path.exists(self.titles_path):
+            with open(self.titles_path, "r", encoding="utf-8") as file:
+                for line in file:
+                    entry = json.loads(line)
+                    self.titles.append(entry["title"])
+                    self.title_uids[entry["title"]] = entry["uid"]
+
+    def commit(self, titles: list[str], uids: list[str], watermark):
+        """Appends newly indexed titles and then advances the watermark."""
+        with open(self.titles_path, "a", encoding="utf-8") as file:
+            for title, uid in zip(titles, uids):
+                file.write(json.dumps({"title": title, "uid": str(uid)}) + "\n")
+                self.titles.append(title)
+                self.title_uids[title] = str(uid)
+
+        tmp_path = self.watermark_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({"_id": str(watermark)}, file)
+        os.replace(tmp_path, self.watermark_path)
+        self.watermark = str(watermark)
+
+class BacklinkingWorker:
+    """
+    Long-lived backlinking service.
+
+    Owns the model, the database handle and the embedding store across rounds,
+    so the model is loaded once per process instead of once per round. After
+    every `run_round()`, `timings` holds the seconds spent in each phase
+    (model_load is only non-zero for the first round).
+
+    With a `state`, rounds are incremental: up to `batch_size` articles
+    inserted after the watermark are scanned against all titles, and older
+    articles are only checked against the titles that were added in this
+    round. Only the new titles are scored against the stored phrases, through
+    a `index_kind` index over the phrase vectors, and only the older articles
+    the state's PhrasePostings list for a matched phrase or all words of a
+    new title are read again, so a round costs in proportion to its new
+    articles rather than the corpus. Incremental rounds return and write only
+    the new links, which the database merges into the stored backlinks.
 
-    return all_backlinks
+    With `processes` > 1, matching is split into shards that run in a process
+    pool; encoding stays in this process, next to the model. More processes
+    than available CPUs only add overhead, so `processes` is capped at that.
+    """
+
+    PHASES = ("model_load", "fetch", "encode", "match", "write_back")
+
+    def __init__(self, database: Database, model=None, store: EmbeddingStore = None, batch_size=50,
+                 encode_batch_size=256, similarity_thresh=0.8, debug_print=False, state: BacklinkingState = None,
+                 rescan_chunk_size=65536, index_kind="exact", processes=1, write_chunk_size=1000, rescan_top_k=1000):
+        if state is not None and store is None:
+            raise ValueError("Incremental backlinking needs an embedding store")
+        self.database = database
+        self.store = store
+        self.state = state
+        self.rescan_chunk_size = rescan_chunk_size
+        self.rescan_top_k = rescan_top_k  # phrases looked at per new title with an approximate phrase index
+        self.index_kind = index_kind
+        if processes > available_cpus():
+            print(f"Only {available_cpus()} CPUs available, matching with {available_cpus()} processes instead of {processes}")
+            processes = available_cpus()
+        self.processes = processes
+        self.write_chunk_size = write_chunk_size
+        self.executor = ProcessPoolExecutor(processes) if processes > 1 else None
+        self.shared_dir: str = None  # matrices shared with the process pool
+        self.shared_titles = None  # (matcher, number of titles, spec entries) of the title files in shared_dir
+        self.title_matcher: TitleMatcher = None
+        self.title_automaton = TitleAutomaton(tokenizer=tokenize)
+        self.batch_size = batch_size
+        self.encode_batch_size = encode_batch_size
+        self.similarity_thresh = similarity_thresh
+        self.debug_print = debug_print
+        self.rounds = 0
+        self.caught_up = True  # whether the last incremental round reached the newest article
+
+        # every phrase of the postings, in the row order of phrase_index
+        self.vocabulary: list[str] = []
+        self.vocabulary_rows: dict[str, int] = {}
+        self.phrase_index = None
+
+        self.timings: dict[str, float] = {}
+        with self.phase("model_load"):
+            self.model = model if model is not None else SentenceTransformer(MODEL_NAME)
+
+        if self.state is not None and len(self.state.titles) > 0:
+            for title in self.state.titles:
+                self.title_automaton.add(title)
+            title_vectors = self.store.encode(self.state.titles, self.encode_texts)
+            self.title_matcher = TitleMatcher(self.state.titles, title_vectors, self.similarity_thresh, self.index_kind)
+        if self.state is not None and self.state.watermark is not None:
+            if self.state.postings.is_empty():
+                self.index_processed_articles()
+            for phrases in self.state.postings.phrases(self.rescan_chunk_size):
+                self.add_vocabulary(phrases, self.store.encode(phrases, self.encode_texts))
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.shared_dir is not None:
+            shutil.rmtree(self.shared_dir, ignore_errors=True)
+            self.shared_dir = self.shared_titles = None
+
+    def format_timings(self) -> str:
+        return " | ".join(f"{name} {self.timings.get(name, 0.0):.2f}s" for name in self.PHASES)
+
+    def encode_texts(self, texts: list[str]) -> np.ndarray:
+        return self.model.encode(texts, batch_size=self.encode_batch_size, convert_to_numpy=True)
+
+    def fetch_articles(self) -> list[Article]:
+        return self.database.sample_articles(self.batch_size)
+
+    def encode_articles(self, articles: list[Article], automaton: TitleAutomaton):
+        """
+        Tokenizes the articles, finds exact title mentions with `automaton` and
+        encodes the titles plus every phrase outside of those mentions.
+        Returns (article_words, article_spans, phrase_vectors), keyed by title.
+        """
+        article_words = {a.title: tokenize(a.content) for a in articles}
+        article_spans = {t: automaton.find(words, exclude_title=t) for t, words in article_words.items()}
+        phrases = list(article_words.keys())
+        for title, words in article_words.items():
+            words_left, pairs_left = uncovered_phrases(words, article_spans[title])
+            phrases.extend(words_left)
+            phrases.extend(pairs_left)
+        phrase_vectors = encode_phrases(phrases, self.model, self.encode_batch_size, self.debug_print, self.store)
+        return article_words, article_spans, phrase_vectors
+
+    def share_titles(self, matcher: TitleMatcher) -> dict:
+        """
+        The files holding `matcher`'s titles and matrix for the process pool,
+        only written again when the titles changed. The matrix file gets a new
+        name every time, so the processes know to rebuild their matcher.
+        """
+        if self.shared_dir is None:
+            self.shared_dir = tempfile.mkdtemp(prefix="backlinking-")
+        if self.shared_titles is not None and self.shared_titles[:2] == (matcher, len(matcher.titles)):
+            return self.shared_titles[2]
+        if self.shared_titles is not None:
+            for path in self.shared_titles[2].values():
+                os.remove(path)
+
+        name = uuid.uuid4().hex
+        files = {"titles": os.path.join(self.shared_dir, f"titles-{name}.json"),
+                 "title_matrix": os.path.join(self.shared_dir, f"titles-{name}.npy")}
+        with open(files["titles"], "w", encoding="utf-8") as file:
+            json.dump(matcher.titles, file)
+        np.save(files["title_matrix"], np.asarray(matcher.title_matrix))
+        self.shared_titles = (matcher, len(matcher.titles), files)
+        return files
+
+    def parse_articles(self, matcher: TitleMatcher, phrase_vectors: PhraseVectors,
+                       items: list[tuple[str, list[str], list]]) -> dict[str, dict[str, str]]:
+        """Runs parse_article for every (title, words, spans) item, sharded over the process pool if there is one."""
+        if self.executor is None or len(items) < 2:
+            results = {}
+            for i, (title, words, spans) in enumerate(items):
+                results[title] = parse_article(matcher, phrase_vectors, title, words, spans)
+                if self.debug_print:
+                    print(f"{i + 1} done", end="\r")
+            return results
+
+        spec = {
+            **self.share_titles(matcher),
+            "phrase_matrix": os.path.join(self.shared_dir, f"phrases-{uuid.uuid4().hex}.npy"),
+            "similarity_thresh": matcher.similarity_thresh,
+            "index_kind": matcher.index_kind,
+            "top_k": matcher.top_k,
+        }
+        try:
+            np.save(spec["phrase_matrix"], phrase_vectors.matrix)
+
+            # a few shards per process, so uneven article lengths even out
+            n_shards = min(len(items), self.processes * 4)
+            futures = []
+            for shard in (items[i::n_shards] for i in range(n_shards)):
+                phrases = set()
+                for _, words, spans in shard:
+                    words_left, pairs_left = uncovered_phrases(words, spans)
+                    phrases.update(words_left)
+                    phrases.update(pairs_left)
+                futures.append(self.executor.submit(parse_shard, spec, phrase_vectors.subset(phrases), shard))
+
+            results = {}
+            for i, future in enumerate(futures):
+                results.update(future.result())
+                if self.debug_print:
+                    print(f"{i + 1}/{n_shards} shards done", end="\r")
+        finally:
+            os.remove(spec["phrase_matrix"])
+        return {title: results[title] for title, _, _ in items}
+
+    def match_articles(self, articles: list[Article], article_words: dict[str, list[str]],
+                       article_spans: dict[str, list], phrase_vectors: PhraseVectors) -> dict[Article, dict[str, str]]:
+        article_article_map = {a.title: a for a in articles}
+        all_titles = list(article_article_map.keys())
+
+        matcher = TitleMatcher(all_titles, phrase_vectors.lookup(all_titles), self.similarity_thresh, self.index_kind)
+
+        items = [(title, article_words[title], article_spans[title]) for title in all_titles]
+        article_backlinks = self.parse_articles(matcher, phrase_vectors, items)
+
+        all_backlinks: dict[Article, dict[str, str]] = {}
+
+        for article in articles:
+            if not article.backlinks:
+                continue
+            # rewrites keys stored before they were normalised
+            all_backlinks[article] = {phrase_key(k): v for k, v in article.backlinks.items()}
+
+        for title in all_titles:
+            article = article_article_map[title]
+            backlinks = {k: article_article_map[t].uid for k, t in article_backlinks[title].items()}
+            if not article in all_backlinks:
+                all_backlinks[article] = {}
+            for k, v in backlinks.items():
+                all_backlinks[article][k] = v
+
+        return all_backlinks
+
+    def write_back(self, all_backlinks: dict[Article, dict[str, str]], merge=False):
+        written = self.database.bulk_update_backlinks(all_backlinks, self.write_chunk_size, merge)
+        if self.debug_print:
+            print(f"Wrote backlinks of {written} articles ({len(all_backlinks) - written} unchanged).")
+
+    def add_vocabulary(self, phrases: list[str], vectors: np.ndarray):
+        """Adds the phrases that aren't in the phrase index yet."""
+        new = []
+        for i, phrase in enumerate(phrases):
+            if phrase not in self.vocabulary_rows:
+                self.vocabulary_rows[phrase] = len(self.vocabulary)
+                self.vocabulary.append(phrase)
+                new.append(i)
+        if len(new) == 0:
+            return
+        vectors = normalize_rows(np.asarray(vectors)[new])
+        if self.phrase_index is None:
+            self.phrase_index = make_index(self.index_kind, vectors.shape[1])
+        self.phrase_index.add(vectors)
+
+    def postings_entry(self, article: Article, words: list[str], spans: list) -> tuple:
+        words_left, pairs_left = uncovered_phrases(words, spans)
+        return article.uid, words, words_left + pairs_left
+
+    def index_processed_articles(self, batch_size=500):
+        """
+        Builds the postings of a state from before they existed: one pass over
+        the articles up to the watermark, in constant memory.
+        """
+        print("Indexing the phrases of already processed articles, once")
+        entries = []
+        for article in self.database.iter_articles(fields=("title", "content")):
+            if str(article.uid) > self.state.watermark:
+                continue
+            words = tokenize(article.content)
+            entries.append(self.postings_entry(article, words, self.title_automaton.find(words, exclude_title=article.title)))
+            if len(entries) == batch_size:
+                self.state.postings.add(entries)
+                entries = []
+        self.state.postings.add(entries)
+
+    def match_vocabulary(self, new_title_matcher: TitleMatcher) -> dict[str, str]:
+        """
+        The stored phrases that match a new title, with that title. Only the
+        new titles are scored: against every phrase vector in chunks with an
+        exact phrase index, and against the `rescan_top_k` nearest phrases of
+        each title with an approximate one. New titles come after all existing
+        ones, so the last matching one wins, like in a full scan.
+        """
+        if self.phrase_index is None or len(new_title_matcher.titles) == 0:
+            return {}
+        title_matrix = new_title_matcher.title_matrix
+        hits = []  # (title column, phrase row)
+        if isinstance(self.phrase_index, ExactIndex):
+            vectors = self.phrase_index.vectors
+            for start in range(0, len(vectors), self.rescan_chunk_size):
+                columns, rows = np.nonzero(title_matrix @ vectors[start:start + self.rescan_chunk_size].T
+                                           >= self.similarity_thresh)
+                hits.extend(zip(columns.tolist(), (rows + start).tolist()))
+        else:
+            similarities, ids = self.phrase_index.search(title_matrix, min(self.rescan_top_k, len(self.phrase_index)))
+            columns, positions = np.nonzero((similarities >= self.similarity_thresh) & (ids >= 0))
+            hits.extend(zip(columns.tolist(), ids[columns, positions].tolist()))
+
+        single_word_columns = set(new_title_matcher.single_word_columns)
+        matched: dict[str, str] = {}
+        for column, row in sorted(hits):
+            phrase = self.vocabulary[row]
+            if " " in phrase or column in single_word_columns:
+                matched[phrase] = new_title_matcher.titles[column]
+        return matched
+
+    def rescan_for_new_titles(self, new_title_matcher: TitleMatcher, skip_uids: set) -> dict[Article, dict[str, str]]:
+        """
+        Finds links from already indexed articles to newly added titles.
+
+        The new titles are matched against the stored phrases once (see
+        match_vocabulary), and the postings then name the old articles that
+        contain a matched phrase or every word of a new title. Only those are
+        read, checked for exact mentions of a new title and for the matched
+        phrases outside of exact mentions.
+        """
+        new_titles = set(new_title_matcher.titles)
+        matched = self.match_vocabulary(new_title_matcher)
+        uids = self.state.postings.with_phrases(matched)
+        for title in new_titles:
+            uids |= self.state.postings.with_all_words(tokenize(title))
+        uids -= {str(uid) for uid in skip_uids}
+
+        rescanned: dict[Article, dict[str, str]] = {}
+        entries = []
+        for article in self.database.iter_articles_by_id(sorted(uids)):
+            words = tokenize(article.content)
+            spans = self.title_automaton.find(words, exclude_title=article.title)
+            # a new title mention can uncover words of an older one
+            entries.append(self.postings_entry(article, words, spans))
+            links = {phrase_key(" ".join(words[start:end])): title for start, end, title in spans if title in new_titles}
+            words_left, pairs_left = uncovered_phrases(words, spans)
+            for phrase in words_left + pairs_left:
+                if phrase in matched and matched[phrase] != article.title and phrase_key(phrase) not in links:
+                    links[phrase_key(phrase)] = matched[phrase]
+            if len(links) > 0:
+                rescanned[article] = links
+        self.state.postings.add(entries)
+        if self.debug_print:
+            print(f"Rescanned {len(uids)} older articles for {len(new_titles)} new titles.")
+        return rescanned
+
+    def run_incremental_round(self, write_back=True) -> dict[Article, dict[str, str]]:
+        with self.phase("fetch"):
+            new_articles = self.database.get_articles_since(self.state.watermark, limit=self.batch_size)
+        self.caught_up = len(new_articles) < self.batch_size
+        if self.debug_print:
+            print(f"Loaded {len(new_articles)} new articles.")
+        if len(new_articles) == 0:
+            return {}
+
+        new_titles, new_uids = [], []
+        for article in new_articles:
+            if article.title not in self.state.title_uids and article.title not in new_titles:
+                new_titles.append(article.title)
+                new_uids.append(str(article.uid))
+                self.title_automaton.add(article.title)
+        title_uids = {**self.state.title_uids, **dict(zip(new_titles, new_uids))}
+
+        with self.phase("encode"):
+            article_words, article_spans, phrase_vectors = self.encode_articles(new_articles, self.title_automaton)
+
+        with self.phase("match"):
+            links: dict[Article, dict[str, str]] = {}
+            if self.title_matcher is not None and len(new_titles) > 0:
+                new_title_matcher = TitleMatcher(new_titles, phrase_vectors.lookup(new_titles), self.similarity_thresh)
+                links = self.rescan_for_new_titles(new_title_matcher, {a.uid for a in new_articles})
+
+            if self.title_matcher is None:
+                self.title_matcher = TitleMatcher(new_titles, phrase_vectors.lookup(new_titles), self.similarity_thresh,
+                                                  self.index_kind)
+            else:
+                self.title_matcher.add_titles(new_titles, phrase_vectors.lookup(new_titles))
+
+            items = [(title, article_words[title], article_spans[title]) for title in article_words]
+            new_links = self.parse_articles(self.title_matcher, phrase_vectors, items)
+            for article in new_articles:
+                links[article] = new_links[article.title]
+
+            # only the new links; the database merges them into the stored ones
+            all_backlinks = {
+                article: {phrase: title_uids[title] for phrase, title in article_links.items()}
+                for article, article_links in links.items()
+            }
+
+            entries = [self.postings_entry(article, article_words[article.title], article_spans[article.title])
+                       for article in new_articles]
+            self.state.postings.add(entries)
+            phrases = list(dict.fromkeys(phrase for _, _, article_phrases in entries for phrase in article_phrases))
+            self.add_vocabulary(phrases, phrase_vectors.lookup(phrases))
+
+        if write_back:
+            with self.phase("write_back"):
+                self.write_back(all_backlinks, merge=True)
+        self.state.commit(new_titles, new_uids, new_articles[-1].uid)
+
+        if self.debug_print:
+            print(f"Finished: {len(new_titles)} new titles, {len(all_backlinks)} articles updated.")
+            print(self.format_timings())
+
+        return all_backlinks
+
+    def run_round(self, write_back=True) -> dict[Article, dict[str, str]]:
+        if self.rounds > 0:
+            self.timings = {"model_load": 0.0}
+        self.rounds += 1
+        if self.state is not None:
+            return self.run_incremental_round(write_back)
+        if self.debug_print:
+            print(f"Starting Backlinking round {self.rounds} with batch_size={self.batch_size}")
+
+        with self.phase("fetch"):
+            articles = self.fetch_articles()
+        if self.debug_print:
+            print(f"Loaded {len(articles)} articles.")
+        if len(articles) == 0:
+            return {}
+
+        with self.phase("encode"):
+            automaton = TitleAutomaton([a.title for a in articles], tokenizer=tokenize)
+            article_words, article_spans, phrase_vectors = self.encode_articles(articles, automaton)
+        if self.debug_print:
+            print("Done with vectorizing the titles and phrases.")
+
+        with self.phase("match"):
+            all_backlinks = self.match_articles(articles, article_words, article_spans, phrase_vectors)
+
+        if write_back:
+            with self.phase("write_back"):
+                self.write_back(all_backlinks)
+
+        if self.debug_print:
+            print("Finished entirely.")
+            print(self.format_timings())
+
+        return all_backlinks
+
+def backlinking_round(database: Database, batch_size=50, debug_print=False, model=None, encode_batch_size=256,
+                      store: EmbeddingStore = None):
+    """Runs a single round with a throwaway worker and returns the backlinks without writing them."""
+    worker = BacklinkingWorker(database, model, store, batch_size, encode_batch_size, debug_print=debug_print)
+    return worker.run_round(write_back=False)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Continuously add backlinks between articles.")
+    parser.add_argument("--incremental", action="store_true", help="only process articles added since the last round")
+    parser.add_argument("--index", choices=["exact", "ivf", "hnsw"], default="exact", help="title index used for matching")
+    parser.add_argument("--processes", type=int, default=1, help="number of processes used for matching")
+    parser.add_argument("--batch-size", type=int, default=50, help="articles processed per round")
+    args = parser.parse_args()
+
+    database = Database(MONGODB_ADDRESS, debug_messages=False)
+    store = EmbeddingStore(EMBEDDING_CACHE_DIR, MODEL_NAME)
+    state = BacklinkingState(BACKLINKING_STATE_DIR) if args.incremental else None
+    worker = BacklinkingWorker(database, store=store, batch_size=args.batch_size, debug_print=True, state=state,
+                               index_kind=args.index, processes=args.processes)
     while True:
-        database = Database(MONGODB_ADDRESS, debug_messages=False)
-        all_backlinks = backlinking_round(database, 50, True)
-        for article, backlinks in all_backlinks.items():
-            database.update_article_backlinks(article.uid, backlinks)
-        print()
\ No newline at end of file
+        worker.run_round()
+        print()
+        if args.incremental and worker.caught_up:
+            time.sleep(10)
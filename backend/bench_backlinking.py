@@ -0,0 +1,146 @@
+"""
+Benchmarks for backlinking.
+
+Runs `BacklinkingWorker` rounds on synthetic articles with a deterministic stand-in
+encoder, so neither the SentenceTransformer model nor MongoDB is needed. With
+--ann it instead measures recall and latency of the title indices in ann_index.py.
+
+    python bench_backlinking.py
+    python bench_backlinking.py --sizes 50 500 --words 300
+    python bench_backlinking.py --sizes 5000 --processes 1 2 4 8
+    python bench_backlinking.py --ann --titles 100000
+"""
+import argparse
+import random
+import time
+import zlib
+
+import numpy as np
+
+from ann_index import ExactIndex, IVFIndex, hnswlib, make_index
+from backlinking import BacklinkingWorker, available_cpus, normalize_rows
+from database import Article
+
+
+class RandomEncoder:
+    """Maps every text to a fixed pseudo-random vector derived from its crc32."""
+
+    def __init__(self, dim=384):
+        self.dim = dim
+        self.vectors: dict[str, np.ndarray] = {}
+
+    def encode_one(self, text: str) -> np.ndarray:
+        if text not in self.vectors:
+            rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+            self.vectors[text] = rng.standard_normal(self.dim).astype(np.float32)
+        return self.vectors[text]
+
+    def encode(self, sentences, **kwargs):
+        if isinstance(sentences, str):
+            return self.encode_one(sentences)
+        if len(sentences) == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self.encode_one(s) for s in sentences])
+
+
+class SyntheticDatabase:
+    """Implements just enough of `Database` for a backlinking round."""
+
+    def __init__(self, n_articles: int, words_per_article: int, vocabulary_size=5000, seed=0):
+        rng = random.Random(seed)
+        vocabulary = [f"word{i}" for i in range(vocabulary_size)]
+        self.articles = []
+        for i in range(n_articles):
+            title = " ".join(rng.sample(vocabulary, rng.choice([1, 2, 3]))) + f" {i}"
+            content = " ".join(rng.choices(vocabulary, k=words_per_article))
+            self.articles.append(Article(title, content, f"{i:024x}", {}))
+
+    def iter_articles(self, **kwargs):
+        return iter(self.articles)
+
+    def sample_articles(self, n: int, **kwargs) -> list[Article]:
+        return random.sample(self.articles, min(n, len(self.articles)))
+
+
+def bench_rounds(n_articles: int, words_per_article: int, rounds: int, model, processes=1) -> tuple[float, int]:
+    """Rounds per second, and the number of processes the worker actually used."""
+    worker = BacklinkingWorker(SyntheticDatabase(n_articles, words_per_article), model, batch_size=n_articles,
+                               processes=processes)
+    try:
+        # warm the encoder's memo and the process pool so we measure the round itself
+        worker.run_round(write_back=False)
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            worker.run_round(write_back=False)
+        return rounds / (time.perf_counter() - start), worker.processes
+    finally:
+        worker.close()
+
+
+def clustered_vectors(n: int, dim: int, rng, n_clusters=1000, noise=1.0) -> np.ndarray:
+    """Unit vectors scattered around random topic centres, closer to real title embeddings than pure noise."""
+    centres = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, n_clusters, n)] + noise * rng.standard_normal((n, dim)).astype(np.float32)
+    return normalize_rows(vectors)
+
+
+def bench_ann(n_titles: int, n_queries: int, dim: int, k=10):
+    rng = np.random.default_rng(0)
+    titles = clustered_vectors(n_titles, dim, rng)
+    # a query is a title plus noise of about the same length, like a loose paraphrase of it
+    noise = 1.0 / np.sqrt(dim) * rng.standard_normal((n_queries, dim)).astype(np.float32)
+    queries = normalize_rows(titles[rng.integers(0, n_titles, n_queries)] + noise)
+
+    def measure(name, index):
+        start = time.perf_counter()
+        index.add(titles)
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        _, ids = index.search(queries, k)
+        latency = (time.perf_counter() - start) / n_queries * 1000
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, true_ids)])
+        recall_1 = np.mean(ids[:, 0] == true_ids[:, 0])
+        print(f"{name:<20} build {build:7.2f}s  {latency:8.4f} ms/query  recall@1 {recall_1:.3f}  recall@{k} {recall:.3f}")
+
+    start = time.perf_counter()
+    exact = ExactIndex(dim)
+    exact.add(titles)
+    _, true_ids = exact.search(queries, k)
+    latency = (time.perf_counter() - start) / n_queries * 1000
+    print(f"{n_titles} titles, {n_queries} queries, dim {dim}")
+    print(f"{'exact':<20} {latency:24.4f} ms/query  recall@1 1.000  recall@{k} 1.000")
+
+    for n_probe in [1, 2, 4, 8, 16, 32]:
+        measure(f"ivf n_probe={n_probe}", IVFIndex(dim, n_probe=n_probe))
+    if hnswlib is not None:
+        for ef in [16, 32, 64, 128]:
+            measure(f"hnsw ef={ef}", make_index("hnsw", dim, ef=max(ef, k)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--words", type=int, default=100, help="words per synthetic article")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1], help="process counts to compare")
+    parser.add_argument("--ann", action="store_true", help="benchmark title index recall and latency instead")
+    parser.add_argument("--titles", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.ann:
+        bench_ann(args.titles, args.queries, args.dim)
+        raise SystemExit
+
+    model = RandomEncoder(args.dim)
+    # speed-ups are only meaningful up to the number of CPUs, the worker caps processes there
+    print(f"{available_cpus()} CPUs available")
+    for n_articles in args.sizes:
+        rounds = args.rounds if n_articles < 5000 else 1
+        baseline = None
+        for processes in args.processes:
+            rps, used = bench_rounds(n_articles, args.words, rounds, model, processes)
+            baseline = baseline or rps
+            print(f"{n_articles:>6} articles, {used} processes: {rps:10.4f} rounds/s ({rps / baseline:.2f}x)")
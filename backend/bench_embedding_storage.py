@@ -0,0 +1,82 @@
+"""
+Storage and read-throughput comparison of the article embedding formats.
+
+Encodes synthetic articles with 1536-dimensional title and content embeddings
+in every format of database.EMBEDDING_FORMATS and reports the BSON size of the
+embeddings per article, how fast documents decode back into float32 vectors
+(the client-side cost of every read that pulls embeddings) and how close the
+decoded vectors stay to the originals. Needs no MongoDB server.
+
+    python bench_embedding_storage.py
+    python bench_embedding_storage.py --articles 5000
+"""
+import argparse
+import time
+
+import bson
+import numpy as np
+
+from ann_index import ExactIndex
+from database import EMBEDDING_FIELDS, EMBEDDING_FORMATS, decode_embedding, encode_embedding
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def make_articles(n_articles: int, dim: int, rng) -> list[dict]:
+    title_vectors = normalize_rows(rng.standard_normal((n_articles, dim)).astype(np.float32))
+    content_vectors = normalize_rows(rng.standard_normal((n_articles, dim)).astype(np.float32))
+    return [
+        {"title": f"Article {i}", "content": "lorem ipsum " * 250, "title_embedding": t, "content_embedding": c}
+        for i, (t, c) in enumerate(zip(title_vectors, content_vectors))
+    ]
+
+
+def encode_article(article: dict, embedding_format: str) -> bytes:
+    document = {"title": article["title"], "content": article["content"]}
+    for field in EMBEDDING_FIELDS:
+        document.update(encode_embedding(field, article[field], embedding_format))
+    return bson.encode(document)
+
+
+def bench_format(articles: list[dict], embedding_format: str, k=10, n_queries=200):
+    plain_size = np.mean([len(bson.encode({"title": a["title"], "content": a["content"]})) for a in articles])
+    encoded = [encode_article(a, embedding_format) for a in articles]
+    embedding_size = np.mean([len(e) for e in encoded]) - plain_size
+
+    start = time.perf_counter()
+    decoded = []
+    for data in encoded:
+        document = bson.decode(data)
+        decoded.append([decode_embedding(document, field) for field in EMBEDDING_FIELDS])
+    elapsed = time.perf_counter() - start
+
+    original = np.stack([a["title_embedding"] for a in articles])
+    titles = normalize_rows(np.stack([d[0] for d in decoded]))
+    cosine = np.mean(np.sum(original * titles, axis=1))
+
+    # how many of the true top-k titles a search over the decoded vectors still finds
+    exact, stored = ExactIndex(original.shape[1]), ExactIndex(original.shape[1])
+    exact.add(original)
+    stored.add(titles)
+    queries = original[:n_queries]
+    _, true_ids = exact.search(queries, k)
+    _, ids = stored.search(queries, k)
+    recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, true_ids)])
+
+    print(f"{embedding_format:<8} {embedding_size / 1024:8.1f} KB/article  "
+          f"{len(articles) / elapsed:9.0f} articles/s  {sum(map(len, encoded)) / elapsed / 2**20:7.1f} MB/s  "
+          f"cosine {cosine:.5f}  recall@{k} {recall:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=1536)
+    args = parser.parse_args()
+
+    articles = make_articles(args.articles, args.dim, np.random.default_rng(0))
+    print(f"{args.articles} articles, two {args.dim}-dimensional embeddings each, ~3 KB of content")
+    for embedding_format in EMBEDDING_FORMATS:
+        bench_format(articles, embedding_format)
@@ -25,13 +25,22 @@ class Brandon:
 
         self.llm = self.llm.bind_tools([IdentifyBacklinks], tool_choice="any")
 
-    def identify_backlinks(self, article_content: str) -> List[str]:
-        response = self.llm.invoke([
+    def make_messages(self, article_content: str):
+        return [
             SystemMessage(content=BRANDON_INIT_PROMPT),
             HumanMessage(content=article_content)
-        ])
+        ]
+
+    @staticmethod
+    def read_backlinks(response) -> List[str]:
         tool_calls = response.tool_calls
         for call in tool_calls:
             if call["name"] == "IdentifyBacklinks":
                 return call["args"]["backlinks"]
-        return []
\ No newline at end of file
+        return []
+
+    def identify_backlinks(self, article_content: str) -> List[str]:
+        return self.read_backlinks(self.llm.invoke(self.make_messages(article_content)))
+
+    async def aidentify_backlinks(self, article_content: str) -> List[str]:
+        return self.read_backlinks(await self.llm.ainvoke(self.make_messages(article_content)))
@@ -1,13 +1,90 @@
+import re
+import threading
+
+import numpy as np
 import pymongo
-from pymongo.operations import SearchIndexModel
-from openai import OpenAI
+from bson.binary import Binary, BinaryVectorDtype, VECTOR_SUBTYPE
+from pymongo.operations import UpdateOne
 from slugify import slugify
 from datetime import datetime
+from itertools import islice
 from unsplash_client import UnsplashPhotoSearch
 from bson.objectid import ObjectId
+from dedupe import SimHashIndex, simhash, to_signed, to_unsigned
+from storage import DuplicateArticleError, MongoStorage, open_storage
+from title_index import AtlasTitleSearch, TitleIndex, TitleRegistry
+from vectorizer import Vectorizer
 
 print(pymongo.__version__, pymongo.__file__)
 
+# legacy "phrase:id,phrase:id" backlinks; ids are always 24 hex digits, which
+# lets us recover phrases that themselves contain ":" or ","
+LEGACY_BACKLINK_PATTERN = re.compile(r"(.*?):([0-9a-f]{24})(?:,|$)", re.DOTALL)
+
+# what Article holds; everything but the embeddings and page metadata
+ARTICLE_FIELDS = ("title", "content", "backlinks")
+
+VECTOR_INDEX_NAME = "vector_index"
+EMBEDDING_FIELDS = ("title_embedding", "content_embedding")
+
+# How article embeddings are stored:
+#   "float32"  arrays of doubles, as the embeddings API returns them (~20 KB per vector in BSON)
+#   "float16"  packed float16 bytes (3 KB); Atlas can't index these, so only for the local title index
+#   "int8"     BSON int8 vectors (1.5 KB) scaled to the full int8 range, with the scale
+#              in "<field>_scale"; indexed with cosine similarity, which ignores the scale
+EMBEDDING_FORMATS = ("float32", "float16", "int8")
+
+
+def encode_embedding(field: str, vector, embedding_format="float32") -> dict:
+    """The document fields that store `vector` under `field`."""
+    if embedding_format == "float32":
+        return {field: [float(x) for x in vector]}
+    vector = np.asarray(vector, dtype=np.float32)
+    if embedding_format == "float16":
+        return {field: Binary(vector.astype("<f2").tobytes())}
+    if embedding_format == "int8":
+        scale = max(float(np.abs(vector).max()), 1e-12) / 127
+        quantized = np.clip(np.round(vector / scale), -127, 127).astype(np.int8)
+        return {field: Binary.from_vector(quantized.tolist(), BinaryVectorDtype.INT8), f"{field}_scale": scale}
+    raise ValueError(f"Unknown embedding format {embedding_format!r}, expected one of {', '.join(EMBEDDING_FORMATS)}")
+
+
+def decode_embedding(entry: dict, field: str):
+    """Reads `field` of a document as a float32 array, whatever format it was stored in (None if missing)."""
+    value = entry.get(field)
+    if value is None:
+        return None
+    if isinstance(value, Binary) and value.subtype == VECTOR_SUBTYPE:
+        # vector payloads start with a dtype and a padding byte
+        return np.frombuffer(value, dtype=np.int8, offset=2).astype(np.float32) * entry[f"{field}_scale"]
+    if isinstance(value, bytes):
+        return np.frombuffer(value, dtype="<f2").astype(np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+def vector_index_definition(embedding_format="float32", quantization=None) -> dict:
+    """
+    The vector_index definition for embeddings stored as `embedding_format`.
+    `quantization` ("scalar" or "binary") lets Atlas quantize float vectors
+    inside the index; int8 vectors are already quantized.
+    """
+    fields = []
+    for path in EMBEDDING_FIELDS:
+        field = {"type": "vector", "path": path, "numDimensions": 1536, "similarity": "dotProduct"}
+        if embedding_format == "int8":
+            field["similarity"] = "cosine"
+        elif quantization is not None:
+            field["quantization"] = quantization
+        fields.append(field)
+    return {"fields": fields}
+
+
+def same_vector_fields(current: dict, definition: dict) -> bool:
+    """Whether an existing index definition already indexes the fields of `definition` the same way."""
+    def key(field):
+        return field.get("path"), field.get("similarity"), field.get("numDimensions"), field.get("quantization", "none")
+    return sorted(map(key, current.get("fields", []))) == sorted(map(key, definition["fields"]))
+
 class Article:
 
     def __init__(self, title, content, uid=None, backlinks=None):
@@ -19,26 +96,35 @@ class Article:
     def __hash__(self):
         return hash(self.title)
 
-class Vectorizer:
+class Database:
 
-    def __init__(self):
-        self.client = OpenAI()
-        
-    def get_embedding(self, text: str) -> list[float]:
-        """Get embedding for a text using OpenAI's text-embedding-ada-002 model"""
-        response = self.client.embeddings.create(
-            model="text-embedding-ada-002",
-            input=text
-        )
-        return response.data[0].embedding
+    # storage addresses this process has already bootstrapped
+    bootstrapped: set[str] = set()
 
-class Database:
+    def __init__(self, mongodb_address: str, debug_messages=False, title_search="local", bootstrap=True,
+                 embedding_format="float32", index_quantization=None, on_duplicate="reject", duplicate_threshold=0.95,
+                 simhash_distance=6):
+        """
+        `mongodb_address` is a MongoDB connection string, or `sqlite:///path.db`
+        for the embedded SQLite storage (see storage.py).
 
-    def __init__(self, mongodb_address: str, debug_messages=False):
-        self.mongodb_client = pymongo.MongoClient(mongodb_address)
-        self.db = self.mongodb_client["william"]
-        self.articles_collection = self.db["articles"]
-        self.vectorizer = Vectorizer()
+        Uploads that duplicate a stored article are rejected, or merged into it
+        as an alias with `on_duplicate="merge"` (None uploads everything): when
+        the content's SimHash is within `simhash_distance` bits of a stored one,
+        or the title or content embedding is at least `duplicate_threshold`
+        similar to those of an article with a similar title.
+        """
+        if on_duplicate not in ("reject", "merge", None):
+            raise ValueError(f"Unknown on_duplicate {on_duplicate!r}, expected 'reject', 'merge' or None")
+        if embedding_format not in EMBEDDING_FORMATS:
+            raise ValueError(f"Unknown embedding format {embedding_format!r}, expected one of {', '.join(EMBEDDING_FORMATS)}")
+        self.embedding_format = embedding_format
+        self.index_quantization = index_quantization
+        self.on_duplicate = on_duplicate
+        self.duplicate_threshold = duplicate_threshold
+        self.duplicates = 0
+        self.storage = open_storage(mongodb_address)
+        self.vectorizer = Vectorizer(debug_messages=debug_messages)
         self.debug_messages = debug_messages
         self.unsplash_client = UnsplashPhotoSearch()
 
@@ -46,16 +132,128 @@ class Database:
         self.all_possible_backlinks: set[str] = set()
         self.reverse_backlink_map: dict[str, Article] = {}
 
-        self.fake_db_dict = {}
+        # Titles and ids of every article, and nothing else. Titles are also searched
+        # by meaning with "local" title search (the default), which keeps the title
+        # embeddings in an in-process TitleIndex, or with "atlas", which uses the
+        # vector_index instead; "words" only matches title words, which also turns
+        # off the embedding dedupe and the veto gate's similarity checks.
+        self.title_lock = threading.Lock()
+        self.titles = TitleRegistry()
+        if title_search == "atlas":
+            if not isinstance(self.storage, MongoStorage):
+                raise ValueError("Atlas title search needs MongoDB storage")
+            self.title_index = AtlasTitleSearch(self.storage.collection, encode_query=self.encode_query_embedding)
+        elif title_search == "local":
+            self.title_index = TitleIndex()
+        elif title_search == "words":
+            self.title_index = None
+        else:
+            raise ValueError(f"Unknown title search {title_search!r}, expected 'words', 'local' or 'atlas'")
+        self.content_hashes = SimHashIndex(simhash_distance)
+        self.load_titles()
+
+        if bootstrap:
+            self.bootstrap()
+
+    def bootstrap(self, force=False) -> bool:
+        """
+        Creates the indexes the storage needs if they are missing; for MongoDB
+        the title, backlinks.article_id and Atlas vector_index indexes. Only runs
+        once per process and storage unless `force`, so uploads never manage indexes.
+        """
+        if self.storage.address in Database.bootstrapped and not force:
+            return True
+        try:
+            self.storage.bootstrap(VECTOR_INDEX_NAME, vector_index_definition(self.embedding_format, self.index_quantization),
+                                   same_vector_fields, self.debug_messages)
+        except self.storage.errors as e:
+            print(f"Could not bootstrap {self.storage.name} indexes: {e}")
+            return False
+        Database.bootstrapped.add(self.storage.address)
+        return True
+
+    def load_titles(self, batch_size=1000):
+        """
+        Warm-loads every stored title, id and content SimHash, plus the title
+        embeddings if titles are searched locally.
+        """
+        fields = ("title", "content_simhash")
+        if isinstance(self.title_index, TitleIndex):
+            fields = ("title", "content_simhash", "title_embedding", "title_embedding_scale")
+        try:
+            batch = []
+            for e in self.storage.iter_documents(fields, batch_size):
+                if "content_simhash" in e:
+                    self.content_hashes.add(to_unsigned(e["content_simhash"]), e["_id"])
+                batch.append(e)
+                if len(batch) == batch_size:
+                    self.add_titles(batch)
+                    batch = []
+            self.add_titles(batch)
+        except self.storage.errors as e:
+            print(f"Could not load titles from {self.storage.name}: {e}")
+        if self.debug_messages:
+            print(f"Loaded {len(self.titles)} titles")
+
+    def add_titles(self, entries):
+        entries = [e for e in entries if e.get("title")]
+        titles = [e["title"] for e in entries]
+        self.titles.add_many(titles, [e["_id"] for e in entries])
+        if isinstance(self.title_index, TitleIndex):
+            self.title_index.add_many(titles, [decode_embedding(e, "title_embedding") for e in entries])
 
-    def upload_article(self, article: Article, upload_online=True):
-        self.fake_db_dict[article.title] = article.content
+    def get_article_id(self, title: str):
+        """Id of the article called exactly `title`, or None."""
+        with self.title_lock:
+            if title not in self.titles:
+                return None
+            uid = self.titles.get(title)
+        if uid is None:
+            # written offline or still uploading, the storage may know more
+            e = self.storage.find_title(title)
+            uid = e["_id"] if e is not None else None
+        return uid
+
+    def titles_with_prefix(self, prefix: str, k=10) -> list[str]:
+        with self.title_lock:
+            return self.titles.prefix_search(prefix, k)
+
+    def encode_query_embedding(self, vector):
+        """`vector` in the form $vectorSearch compares against the stored title embeddings."""
+        query_format = "int8" if self.embedding_format == "int8" else "float32"
+        return encode_embedding("query", vector, query_format)["query"]
+
+    def note_title(self, article: Article):
+        """Makes a title visible to query_titles right away, before its upload has finished."""
+        with self.title_lock:
+            self.titles.add(article.title, article.uid)
+
+    def upload_article(self, article: Article, upload_online=True, upload_id=None):
+        """
+        Uploads an article with its embeddings and an image, returning its id.
+        The id is assigned by the storage at insert time, so ids keep following
+        insert order. Repeating an upload with the same `upload_id` returns the
+        id of the first one instead of inserting the article again; the unique
+        index on `upload_id` catches it, so a first upload is a single write.
+        """
+        self.note_title(article)
 
         if not upload_online:
-            return
+            return None
 
-        title_embedding = self.vectorizer.get_embedding(article.title)
-        content_embedding = self.vectorizer.get_embedding(article.content)
+        # near-identical text is caught before paying for embeddings or an image
+        fingerprint = simhash(article.content)
+        if self.on_duplicate is not None:
+            duplicate = self.content_hashes.find(fingerprint)
+            if duplicate is not None:
+                return self.handle_duplicate(article, duplicate, "near-identical text")
+
+        # one request for both, shared with any concurrent uploads
+        title_embedding, content_embedding = self.vectorizer.get_embeddings([article.title, article.content])
+        if self.on_duplicate is not None:
+            duplicate = self.find_similar_article(title_embedding, content_embedding)
+            if duplicate is not None:
+                return self.handle_duplicate(article, duplicate, "similar embeddings")
         
         try:
             image_url = self.unsplash_client.search_photos(article.title)
@@ -80,84 +278,269 @@ class Database:
             },
             "votes": 1,
             # Add vector embeddings
-            "title_embedding": title_embedding,
-            "content_embedding": content_embedding
+            **encode_embedding("title_embedding", title_embedding, self.embedding_format),
+            **encode_embedding("content_embedding", content_embedding, self.embedding_format),
+            "content_simhash": to_signed(fingerprint),
         }
 
 
-        self.upload_article_data(article_data)
+        if upload_id is not None:
+            article_data["upload_id"] = upload_id
+
+        uid = self.upload_article_data(article_data)
+        article.uid = uid if uid is not None else article.uid
+        with self.title_lock:
+            self.titles.add(article.title, uid)
+            if self.title_index is not None:
+                self.title_index.add(article.title, title_embedding)
+        if uid is not None:
+            self.content_hashes.add(fingerprint, uid)
+        return uid
+
+    def find_similar_article(self, title_embedding, content_embedding, candidates=3):
+        """
+        Id of a stored article whose title embedding, or whose content embedding
+        if their titles are at least somewhat alike, is duplicate_threshold
+        similar to the given ones. None if there is none, or titles aren't
+        searched by meaning.
+        """
+        if self.title_index is None:
+            return None
+        with self.title_lock:
+            matches = [(self.titles.get(t), s) for t, s in self.title_index.vector_search(title_embedding, candidates)]
+        content = np.asarray(content_embedding, dtype=np.float32)
+        content = content / max(np.linalg.norm(content), 1e-12)
+        for uid, title_similarity in matches:
+            if uid is None:
+                continue
+            if title_similarity >= self.duplicate_threshold:
+                return uid
+            stored = decode_embedding(self.storage.get(uid, ("content_embedding", "content_embedding_scale")) or {},
+                                      "content_embedding")
+            if stored is not None and content @ stored / max(np.linalg.norm(stored), 1e-12) >= self.duplicate_threshold:
+                return uid
+        return None
+
+    def handle_duplicate(self, article: Article, duplicate_id, reason: str):
+        """Rejects `article`, or records its title as an alias of the duplicate; returns the duplicate's id."""
+        if duplicate_id == article.uid:
+            return duplicate_id  # the same article again, e.g. a retried upload
+        self.duplicates += 1
+        print(f"Not uploading '{article.title}', it duplicates article {duplicate_id} ({reason})")
+        with self.title_lock:
+            self.titles.add(article.title, duplicate_id)
+        if self.on_duplicate == "merge":
+            stored = self.storage.get(duplicate_id, ("aliases",)) or {}
+            aliases = stored.get("aliases", [])
+            if article.title not in aliases:
+                self.storage.update_fields([(duplicate_id, {"aliases": aliases + [article.title]}, [])])
+        return duplicate_id
 
     def upload_article_data(self, article_data):
+        """Inserts an article document, returning its id (None if the insert failed)."""
         try:
             # Insert and get the inserted ID
-            result = self.articles_collection.insert_one(article_data)
-            
-            # Create vector search index if it doesn't exist
-            try:
-                index_definition = {
-                    "mappings": {
-                        "fields": [
-                            {
-                                "type": "vector",
-                                "path": "title_embedding",
-                                "numDimensions": 1536,
-                                "similarity": "dotProduct"
-                                # "quantization": "scalar"  # Remove if your Atlas version doesn't support it
-                            },
-                            {
-                                "type": "vector",
-                                "path": "content_embedding",
-                                "numDimensions": 1536,
-                                "similarity": "dotProduct"
-                            }
-                        ]
-                    }
-                }
-                self.articles_collection.create_search_index(
-                    "vector_index",
-                    SearchIndexModel(
-                        name="vector_index",
-                        definition=index_definition
-                    )
-                )
-            except Exception as e:
-                # Index might already exist
-                if self.debug_messages:
-                    print(f"Note: Vector index creation attempt: {str(e)}")
+            inserted_id = self.storage.insert(article_data)
             
             # Verify the insertion by fetching the document
-            inserted_doc = self.articles_collection.find_one({"_id": result.inserted_id})
             if self.debug_messages:
-                print("\n=== MongoDB Insertion Test ===")
-                print(f"Document inserted with ID: {result.inserted_id}")
+                inserted_doc = self.storage.get(inserted_id, ("title", "createdAt"))
+                print(f"\n=== {self.storage.name} Insertion Test ===")
+                print(f"Document inserted with ID: {inserted_id}")
                 print(f"Verification - Found document title: {inserted_doc['title']}")
                 print(f"Document timestamp: {inserted_doc['createdAt']}")
                 print("Vector embeddings added for title and content")
                 print("===========================\n")
-            
-        except pymongo.errors.PyMongoError as e:
+            return inserted_id
+
+        except DuplicateArticleError:
+            # uploaded before, e.g. by a write-behind retry after a crash
+            if article_data.get("upload_id") is None:
+                return None
+            return self.storage.find_upload(article_data["upload_id"])
+        except self.storage.errors as e:
             if self.debug_messages:
-                print(f"MongoDB Error: {str(e)}")
-
-    def query_titles(self, query: str) -> str:
-        tokens = query.lower().split(" ")
-        written_articles = list(self.fake_db_dict.keys())
-        matches = [
-            article for article in written_articles
-            if any(token in article.lower() for token in tokens)
-        ]
+                print(f"{self.storage.name} Error: {str(e)}")
+
+    def equivalent_title(self, title: str):
+        """An existing title with the same words as `title`, ignoring case, order and stopwords, or None."""
+        with self.title_lock:
+            return self.titles.equivalent(title)
+
+    @property
+    def has_title_vectors(self) -> bool:
+        """Whether titles are searched by meaning, so nearest_titles can find anything."""
+        return self.title_index is not None
+
+    def nearest_titles(self, embedding, k=5) -> list[tuple[str, float]]:
+        """The `k` titles whose embeddings are closest to `embedding`, with their cosine similarity."""
+        if self.title_index is None:
+            return []
+        with self.title_lock:
+            return self.title_index.vector_search(embedding, k, min_similarity=-1.0)
+
+    def query_titles(self, query: str, k=10) -> str:
+        # only pay for a query embedding if there are title embeddings to compare it with
+        query_embedding = self.vectorizer.get_embedding(query) if self.title_index is not None else None
+        with self.title_lock:
+            matches = self.title_index.search(query, query_embedding, k) if self.title_index is not None else []
+            matches += [t for t in self.titles.search(query, k=k) if t not in matches]
         if len(matches) == 0:
             return "No articles with similar name found."
-        return "\n".join(matches)
+        return "\n".join(matches[:k])
     
+    def article_from_entry(self, e) -> Article:
+        return Article(e.get("title"), e.get("content"), e["_id"], self.decode_backlinks(e.get("backlinks")))
+
+    def iter_articles(self, fields=ARTICLE_FIELDS, batch_size=500, after_id=None):
+        """
+        Streams articles from storage in batches of `batch_size`, oldest first
+        after `after_id` if given. Only `fields` are read (server-side projection
+        on MongoDB), so the embeddings are never transferred unless asked for,
+        and memory stays constant in the corpus size.
+        """
+        for e in self.storage.iter_documents(fields, batch_size, after_id):
+            yield self.article_from_entry(e)
+
+    def iter_articles_by_id(self, article_ids, fields=ARTICLE_FIELDS, batch_size=500):
+        """Streams the articles with the given ids, reading `batch_size` of them per query."""
+        article_ids = list(article_ids)
+        for start in range(0, len(article_ids), batch_size):
+            for e in self.storage.find_many(article_ids[start:start + batch_size], fields):
+                yield self.article_from_entry(e)
+
+    def sample_articles(self, n: int, fields=ARTICLE_FIELDS) -> list[Article]:
+        """`n` random articles, sampled by the storage instead of shuffling the whole collection here."""
+        return [self.article_from_entry(e) for e in self.storage.sample(n, fields)]
+
     def get_all_articles(self) -> list[Article]:
-        cursor = self.articles_collection.find("")
-        article_entries = list(cursor)
-        return [Article(e["title"], e["content"], e["_id"], e["backlinks"] if "backlinks" in e else "") for e in article_entries]
+        return list(self.iter_articles())
     
+    def get_articles_since(self, article_id=None, limit=None) -> list[Article]:
+        """The first `limit` articles (all if None) inserted after `article_id` (or ever), oldest first."""
+        batch_size = 500 if limit is None else min(500, limit)
+        articles = self.iter_articles(batch_size=batch_size, after_id=article_id or ObjectId("0" * 24))
+        return list(islice(articles, limit))
+
+    def get_linking_articles(self, article_id) -> list[Article]:
+        """'What links here': titles and ids of all articles with a backlink to `article_id`."""
+        return [Article(e["title"], None, e["_id"]) for e in self.storage.find_linking(article_id)]
+
+    def encode_backlinks(self, backlinks: dict) -> list[dict]:
+        return [{"phrase": str(phrase), "article_id": ObjectId(str(target))} for phrase, target in backlinks.items()]
+
+    def decode_backlinks(self, stored) -> dict[str, str]:
+        """Turns stored backlinks into {phrase: article id}, accepting the legacy string format too."""
+        if not stored:
+            return {}
+        if isinstance(stored, str):
+            return {phrase: target for phrase, target in LEGACY_BACKLINK_PATTERN.findall(stored)}
+        return {b["phrase"]: str(b["article_id"]) for b in stored}
+
     def update_article_backlinks(self, article_id, backlinks):
-        backlink_str = ",".join(":".join((str(b1), str(b2))) for b1, b2 in backlinks.items())
-        self.articles_collection.update_one(
-            {"_id": ObjectId(article_id)},
-            {"$set": {"backlinks": backlink_str}}
-        )
\ No newline at end of file
+        self.storage.write_backlinks([(article_id, self.encode_backlinks(backlinks))])
+
+    def bulk_update_backlinks(self, all_backlinks: dict[Article, dict], chunk_size=1000, merge=False) -> int:
+        """
+        Writes the backlinks of many articles as unordered bulk writes of
+        `chunk_size` updates each, instead of one round trip per article.
+        With `merge`, the given backlinks are merged into the stored ones by
+        the database instead of replacing them. Articles whose stored
+        backlinks wouldn't change are skipped. Returns the number of updates sent.
+        """
+        updates = []
+        for article, backlinks in all_backlinks.items():
+            stored = article.backlinks or {}
+            backlinks = {str(p): str(t) for p, t in backlinks.items()}
+            if merge and all(stored.get(p) == t for p, t in backlinks.items()):
+                continue
+            if not merge and backlinks == stored:
+                continue
+            updates.append((article.uid, self.encode_backlinks(backlinks)))
+
+        self.storage.write_backlinks(updates, merge, chunk_size)
+        return len(updates)
+
+    def migrate_backlinks(self, chunk_size=1000) -> int:
+        """
+        One-off migration of legacy "phrase:id,phrase:id" backlink strings to
+        the structured format, plus the index behind get_linking_articles.
+        Safe to run repeatedly. Returns the number of migrated documents.
+        Only MongoDB ever stored the legacy format.
+        """
+        if not isinstance(self.storage, MongoStorage):
+            return 0
+        self.storage.collection.create_index("backlinks.article_id")
+        cursor = self.storage.collection.find({"backlinks": {"$type": "string"}}, {"backlinks": 1})
+        operations = [
+            UpdateOne({"_id": e["_id"]}, {"$set": {"backlinks": self.encode_backlinks(self.decode_backlinks(e["backlinks"]))}})
+            for e in cursor
+        ]
+        self.storage.bulk_write(operations, chunk_size, "backlink migrations")
+        return len(operations)
+
+    def convert_embeddings(self, chunk_size=500) -> int:
+        """
+        Rewrites every stored embedding in this Database's embedding_format.
+        Reads stream in chunks, so this runs in constant memory. Returns the
+        number of rewritten documents.
+        """
+        converted = 0
+        fields = [f for field in EMBEDDING_FIELDS for f in (field, f"{field}_scale")]
+        updates = []
+        for e in self.storage.iter_documents(fields, chunk_size):
+            values, removed = {}, []
+            for field in EMBEDDING_FIELDS:
+                vector = decode_embedding(e, field)
+                if vector is not None:
+                    values.update(encode_embedding(field, vector, self.embedding_format))
+                    if self.embedding_format != "int8" and f"{field}_scale" in e:
+                        removed.append(f"{field}_scale")
+            if len(values) > 0:
+                updates.append((e["_id"], values, removed))
+            if len(updates) == chunk_size:
+                self.storage.update_fields(updates, chunk_size)
+                converted += len(updates)
+                updates = []
+        self.storage.update_fields(updates, chunk_size)
+        return converted + len(updates)
+
+    def copy_to(self, address: str, chunk_size=500) -> int:
+        """
+        Copies every article to the storage at `address` (e.g. a sqlite:/// file
+        for benchmarks without a cluster) in bulk inserts of `chunk_size`.
+        Articles already there are skipped. Returns the number of copied articles.
+        """
+        target = open_storage(address)
+        copied = 0
+        batch = []
+        for document in self.storage.iter_documents(None, chunk_size):
+            batch.append(document)
+            if len(batch) == chunk_size:
+                copied += target.insert_many(batch)
+                batch = []
+        return copied + target.insert_many(batch)
+
+
+if __name__ == "__main__":
+    import argparse
+    from secret_keys import MONGODB_ADDRESS
+
+    parser = argparse.ArgumentParser(description="Maintenance commands for the articles collection.")
+    parser.add_argument("command", choices=["bootstrap", "migrate-backlinks", "convert-embeddings", "copy"])
+    parser.add_argument("--target", help="storage address to copy to, e.g. sqlite:///william.db")
+    parser.add_argument("--embedding-format", choices=EMBEDDING_FORMATS, default="float32")
+    parser.add_argument("--index-quantization", choices=["scalar", "binary"], default=None)
+    args = parser.parse_args()
+
+    database = Database(MONGODB_ADDRESS, debug_messages=True, bootstrap=False, embedding_format=args.embedding_format,
+                        index_quantization=args.index_quantization)
+    if args.command == "bootstrap":
+        database.bootstrap(force=True)
+    elif args.command == "copy":
+        print(f"Copied {database.copy_to(args.target)} articles to {args.target}.")
+    elif args.command == "migrate-backlinks":
+        print(f"Migrated backlinks of {database.migrate_backlinks()} articles.")
+    elif args.command == "convert-embeddings":
+        print(f"Converted embeddings of {database.convert_embeddings()} articles to {args.embedding_format}.")
+        database.bootstrap(force=True)
\ No newline at end of file
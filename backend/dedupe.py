@@ -0,0 +1,69 @@
+import hashlib
+import re
+import threading
+
+import numpy as np
+
+SIMHASH_BITS = 64
+
+
+def simhash(text: str, shingle_size=3) -> int:
+    """64 bit SimHash over the word shingles of `text`; near-identical texts differ in few bits."""
+    words = re.findall(r"\w+", text.lower())
+    shingles = {" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))}
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles],
+        dtype=np.uint64,
+    )
+    bits = (hashes[:, None] >> np.arange(SIMHASH_BITS, dtype=np.uint64)) & np.uint64(1)
+    votes = bits.sum(axis=0) * 2 > len(hashes)
+    return sum(1 << int(i) for i in np.flatnonzero(votes))
+
+
+def to_signed(fingerprint: int) -> int:
+    """Fingerprints are stored as signed 64 bit integers, which is what BSON and SQLite hold."""
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+def to_unsigned(fingerprint: int) -> int:
+    return fingerprint + (1 << 64) if fingerprint < 0 else fingerprint
+
+
+class SimHashIndex:
+    """
+    Finds stored fingerprints within `max_distance` bits of a query. The bits
+    are split into `max_distance + 1` bands, and every fingerprint is filed
+    under each of its bands. Two fingerprints at most `max_distance` bits apart
+    agree on at least one whole band, so a lookup only has to compare against
+    fingerprints sharing a band with the query.
+    """
+
+    def __init__(self, max_distance=6):
+        self.max_distance = max_distance
+        n_bands = max_distance + 1
+        self.band_edges = [round(i * SIMHASH_BITS / n_bands) for i in range(n_bands + 1)]
+        self.buckets: dict[tuple[int, int], list[tuple[int, object]]] = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(b) for (band, _), b in self.buckets.items() if band == 0)
+
+    def bands(self, fingerprint: int):
+        for band, (start, end) in enumerate(zip(self.band_edges, self.band_edges[1:])):
+            yield band, (fingerprint >> start) & ((1 << (end - start)) - 1)
+
+    def add(self, fingerprint: int, uid):
+        with self.lock:
+            for key in self.bands(fingerprint):
+                self.buckets.setdefault(key, []).append((fingerprint, uid))
+
+    def find(self, fingerprint: int):
+        """The id of the closest stored fingerprint within `max_distance` bits, or None."""
+        best, best_distance = None, self.max_distance + 1
+        with self.lock:
+            for key in self.bands(fingerprint):
+                for other, uid in self.buckets.get(key, ()):
+                    distance = bin(fingerprint ^ other).count("1")
+                    if distance < best_distance:
+                        best, best_distance = uid, distance
+        return best
@@ -0,0 +1,325 @@
+import hashlib
+import json
+import os
+import re
+import struct
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class EmbeddingStore:
+    """
+    Persistent embedding cache keyed by (model name, text).
+
+    Every model gets its own directory holding a raw memory-mapped vector
+    matrix (float16 by default), an append-only index of the texts in row
+    order and a small meta file. Recently used vectors are additionally kept
+    in an in-RAM LRU layer of at most `lru_size` entries, so the process stays
+    bounded no matter how many texts have been stored on disk.
+
+    With `hash_keys`, texts are stored under their sha256 digest instead of
+    verbatim, which keeps the index small for long texts (`texts()` then
+    returns digests). With `max_entries`, the store is compacted down to its
+    most recently used `evict_to` share whenever it grows past that size.
+
+    Several processes may share a directory. Changes happen under a lock file
+    (fcntl, so only on POSIX), and every writer first catches up with the rows
+    and compactions of the others. Reads don't take the lock: they see the rows
+    this process knew about at its last write or `flush`. Reads are recorded in
+    memory and written to disk every `flush_every` hits, by `put_many` and by
+    `flush`.
+    """
+
+    def __init__(self, directory: str, model_name: str, dtype="float16", lru_size=100_000, initial_capacity=1 << 16,
+                 hash_keys=False, max_entries=None, evict_to=0.75, flush_every=1000):
+        self.model_name = model_name
+        self.directory = os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name))
+        self.lru_size = lru_size
+        self.initial_capacity = initial_capacity
+        self.hash_keys = hash_keys
+        self.max_entries = max_entries
+        self.evict_to = evict_to
+        self.flush_every = flush_every
+
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self.lock_path = os.path.join(self.directory, "lock")
+        self.generation = 0
+        self._set_paths()
+
+        self.dtype = np.dtype(dtype)
+        self.dim = None
+        self.capacity = 0
+        self.vectors = None
+        self.last_used = None  # per row "clock" value of its last get or put, persisted for eviction
+        self.clock = 0
+        self.touched: dict[str, int] = {}  # clock of reads not written to last_used yet
+        self.rows: dict[str, int] = {}
+        self.index_offset = 0  # bytes of the index file already read into rows
+        self.lru: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        with self.locked():
+            self._sync()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, text: str):
+        return self.key(text) in self.rows
+
+    def key(self, text: str) -> str:
+        if self.hash_keys:
+            return hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return text
+
+    def texts(self) -> list[str]:
+        """All stored keys (the texts themselves unless `hash_keys`), in row order."""
+        return list(self.rows.keys())
+
+    def matrix(self) -> np.ndarray:
+        """All stored vectors in row order, as a view on the memmap."""
+        if self.vectors is None:
+            return np.zeros((0, self.dim or 0), dtype=self.dtype)
+        return self.vectors[:len(self.rows)]
+
+    def _set_paths(self):
+        # compaction writes a new generation of files and then switches meta.json over to it
+        suffix = "" if self.generation == 0 else f".{self.generation}"
+        self.vectors_path = os.path.join(self.directory, f"vectors{suffix}.bin")
+        self.index_path = os.path.join(self.directory, f"index{suffix}.bin")
+        self.last_used_path = os.path.join(self.directory, f"last_used{suffix}.bin")
+
+    def _open_memmaps(self):
+        self.vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r+", shape=(self.capacity, self.dim))
+        with open(self.last_used_path, "ab") as file:
+            file.truncate(self.capacity * 8)
+        self.last_used = np.memmap(self.last_used_path, dtype=np.int64, mode="r+", shape=(self.capacity,))
+
+    @contextmanager
+    def locked(self):
+        """Holds the lock shared by all processes using this directory. Not reentrant."""
+        # a fresh file description per call, so threads of one process exclude each other as well
+        with open(self.lock_path, "a") as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            yield
+
+    def _sync(self):
+        """Catches up with rows and compactions of other processes. Needs the lock."""
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        if meta.get("generation", 0) != self.generation:
+            # another process compacted the store, so row numbers changed
+            self.generation = meta.get("generation", 0)
+            self.rows = {}
+            self.index_offset = 0
+            self.vectors = None
+        if self.vectors is None or meta["capacity"] != self.capacity:
+            self.dim = meta["dim"]
+            self.dtype = np.dtype(meta["dtype"])
+            self.capacity = meta["capacity"]
+            self._set_paths()
+            self._open_memmaps()
+
+        # the index is a sequence of (uint32 length, utf-8 bytes) records, one per row
+        with open(self.index_path, "rb") as file:
+            file.seek(self.index_offset)
+            data = file.read()
+        start = len(self.rows)
+        offset = 0
+        while offset + 4 <= len(data):
+            (length,) = struct.unpack_from("<I", data, offset)
+            if offset + 4 + length > len(data):
+                break  # torn write at the end of the file, drop it
+            text = data[offset + 4:offset + 4 + length].decode("utf-8")
+            self.rows[text] = len(self.rows)
+            offset += 4 + length
+        self.index_offset += offset
+        self.clock = max(self.clock, int(self.last_used[start:len(self.rows)].max(initial=0)))
+
+    def _write_meta(self):
+        meta = {"dim": self.dim, "dtype": self.dtype.name, "capacity": self.capacity, "generation": self.generation}
+        with open(self.meta_path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(meta, file)
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+
+    def _write_touched(self):
+        found = [(self.rows[key], clock) for key, clock in self.touched.items() if key in self.rows]
+        self.touched.clear()
+        if len(found) > 0:
+            rows, clocks = np.array(found, dtype=np.int64).T
+            self.last_used[rows] = np.maximum(self.last_used[rows], clocks)
+
+    def flush(self):
+        """Writes the recorded reads to disk and picks up rows other processes added."""
+        with self.locked():
+            self._sync()
+            if self.last_used is not None:
+                self._write_touched()
+                self.last_used.flush()
+
+    def _reserve(self, n_rows: int):
+        if self.vectors is not None and n_rows <= self.capacity:
+            return
+        capacity = max(self.capacity, self.initial_capacity)
+        while capacity < n_rows:
+            capacity *= 2
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.last_used.flush()
+        with open(self.vectors_path, "ab") as file:
+            file.truncate(capacity * self.dim * self.dtype.itemsize)
+        self.capacity = capacity
+        self._open_memmaps()
+        self._write_meta()
+
+    def _write_records(self, path: str, keys) -> int:
+        written = 0
+        with open(path, "ab") as file:
+            for key in keys:
+                encoded = key.encode("utf-8")
+                written += file.write(struct.pack("<I", len(encoded)))
+                written += file.write(encoded)
+        return written
+
+    def evict(self, n_keep: int):
+        """Drops all but the `n_keep` most recently used entries."""
+        with self.locked():
+            self._sync()
+            if self.last_used is not None:
+                self._write_touched()
+                self._evict(n_keep)
+
+    def _evict(self, n_keep: int):
+        n = len(self.rows)
+        if n <= n_keep:
+            return
+        keep = np.sort(np.argsort(-self.last_used[:n], kind="stable")[:n_keep])
+        keys = self.texts()
+        kept_keys = [keys[i] for i in keep]
+        kept_vectors = np.array(self.vectors[keep])
+        kept_last_used = np.array(self.last_used[keep])
+
+        old_generation = self.generation
+        self.vectors.flush()
+        self.vectors = self.last_used = None
+        self.generation += 1
+        self._set_paths()
+        for path in [self.vectors_path, self.index_path, self.last_used_path]:
+            if os.path.exists(path):
+                os.remove(path)  # leftovers of an interrupted compaction
+        with open(self.vectors_path, "ab") as file:
+            file.truncate(self.capacity * self.dim * self.dtype.itemsize)
+        self._open_memmaps()
+        self.vectors[:n_keep] = kept_vectors
+        self.last_used[:n_keep] = kept_last_used
+        self.vectors.flush()
+        self.last_used.flush()
+        self.index_offset = self._write_records(self.index_path, kept_keys)
+        self._write_meta()  # the switch to the new generation
+        self._remove_generations(old_generation)
+
+        self.rows = {key: row for row, key in enumerate(kept_keys)}
+        kept = set(kept_keys)
+        for key in [k for k in self.lru if k not in kept]:
+            del self.lru[key]
+
+    def _remove_generations(self, last: int):
+        """Removes the files of generation `last` and of older ones left behind."""
+        pattern = re.compile(r"(vectors|index|last_used)(\.(\d+))?\.bin$")
+        for name in os.listdir(self.directory):
+            match = pattern.match(name)
+            if match is None or int(match.group(3) or 0) > last:
+                continue
+            try:
+                # processes still mapping them keep reading the old data on POSIX until they sync
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass  # mapped elsewhere on Windows, the next compaction tries again
+
+    def _remember(self, text: str, vector: np.ndarray):
+        self.lru[text] = vector
+        self.lru.move_to_end(text)
+        while len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def get(self, text: str):
+        """Returns the stored float32 vector for `text`, or None."""
+        key = self.key(text)
+        if key not in self.rows:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.clock += 1
+        self.touched[key] = self.clock
+        if len(self.touched) >= self.flush_every:
+            self.flush()
+        if key in self.lru:
+            self.lru.move_to_end(key)
+            return self.lru[key]
+        vector = np.array(self.vectors[self.rows[key]], dtype=np.float32)
+        self._remember(key, vector)
+        return vector
+
+    def put_many(self, texts: list[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(texts) == 0:
+            return
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+
+        with self.locked():
+            self._sync()
+            if self.last_used is not None:
+                self._write_touched()
+            new = [(k, v) for k, v in dict(zip(map(self.key, texts), vectors)).items() if k not in self.rows]
+            if len(new) == 0:
+                return
+            start = len(self.rows)
+            self._reserve(start + len(new))
+            stored = np.stack([v for _, v in new]).astype(self.dtype)
+            self.vectors[start:start + len(new)] = stored
+            self.last_used[start:start + len(new)] = np.arange(self.clock + 1, self.clock + len(new) + 1)
+            self.clock += len(new)
+            self.vectors.flush()
+            self.last_used.flush()
+
+            # only index rows once their vectors are on disk
+            self.index_offset += self._write_records(self.index_path, [k for k, _ in new])
+            for (key, _), vector in zip(new, stored.astype(np.float32)):
+                self.rows[key] = len(self.rows)
+                self._remember(key, vector)
+
+            if self.max_entries is not None and len(self.rows) > self.max_entries:
+                self._evict(int(self.max_entries * self.evict_to))
+
+    def encode(self, texts: list[str], encode_fn) -> np.ndarray:
+        """
+        Returns one vector per text, calling `encode_fn(missing_texts)` only for
+        texts that are not stored yet and storing its results.
+        """
+        found = {}
+        for text in dict.fromkeys(texts):
+            vector = self.get(text)
+            if vector is not None:
+                found[text] = vector
+        missing = [t for t in dict.fromkeys(texts) if t not in found]
+        if len(missing) > 0:
+            # round through the storage dtype so results don't depend on whether they came from disk
+            missing_vectors = np.asarray(encode_fn(missing)).astype(self.dtype).astype(np.float32)
+            self.put_many(missing, missing_vectors)
+            found.update(zip(missing, missing_vectors))
+        if len(texts) == 0:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return np.stack([found[t] for t in texts])
@@ -1,15 +1,29 @@
 import cv2
 from manager import Manager
+from pipeline import Pipeline
 from secret_keys import TWITCH_KEY
 from video import VideoStreamer
 
 
 def main():
+    PIPELINE_MODE = False
+    if PIPELINE_MODE:
+        # several writers and reviewers at once, for bulk generation without the video
+        pipeline = Pipeline("gpt-4o-mini", upload_online=True, writers=4, reviewers=2, requests_per_minute=500)
+        try:
+            pipeline.run()
+        finally:
+            pipeline.close()
+        return
+
     man = Manager("gpt-4o-mini", upload_online=True)
     VIDEO_MODE = False
     if not VIDEO_MODE:
-        while True:
-            man.get_next_article()
+        try:
+            while True:
+                man.get_next_article()
+        finally:
+            man.close()
     else:
         STREAM_MODE = False
         # Replace with your actual streaming URL and stream key.
@@ -32,6 +46,7 @@ def main():
             print("Live stream stopped.")
         finally:
             streamer.close()
+            man.close()
 
 
 if __name__ == "__main__":
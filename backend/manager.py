@@ -1,45 +1,252 @@
+import asyncio
 import os
 import random
+import time
+from contextlib import contextmanager
+from typing import Optional
 
 from addison import Addison
 from brandon import Brandon
 from database import Article, Database
 from secret_keys import *
+from upload_queue import UploadQueue
+from veto_gate import REPEAT_ADVICE, VetoGate
 from william import William
 
 # Create test_articles directory if it doesn't exist
 os.makedirs("test_articles", exist_ok=True)
 
 class Manager:
-    def __init__(self, model_name="gpt-4o-mini", upload_online=False):
+    STAGES = ("propose", "write", "review", "backlinks", "upload")
+
+    def __init__(self, model_name="gpt-4o-mini", upload_online=False, review_timeout=60.0, backlinks_timeout=60.0,
+                 review_attempts=2, pre_veto=True, title_candidates=3, max_title_rounds=5, title_search="local"):
+        self.model_name = model_name
         self.upload_online = upload_online
+        self.review_timeout = review_timeout
+        self.backlinks_timeout = backlinks_timeout
+        self.review_attempts = review_attempts
+        # William proposes this many titles and only writes the approved one; 0 writes first and reviews after
+        self.title_candidates = title_candidates
+        # after this many rounds of vetoed titles William writes an article first after all
+        self.max_title_rounds = max_title_rounds
 
         # init models
-        self.william = William(model_name=model_name, history_size=3, temperature=0.85)
+        self.william = self.make_william()
         self.brandon = Brandon(model_name=model_name, temperature=0.7)
         self.addison = Addison(model_name=model_name)
 
         # init database
-        self.database = Database(MONGODB_ADDRESS, debug_messages=False)
+        # "local" keeps title embeddings for Addison's search, the duplicate check and the veto gate
+        self.database = Database(MONGODB_ADDRESS, debug_messages=False, title_search=title_search)
+        # online uploads happen in the background so William can start the next article right away
+        self.uploads = UploadQueue(self.database) if upload_online else None
+        # settles obvious duplicates and clearly new topics without asking Addison
+        self.gate = VetoGate(self.database) if pre_veto else None
 
         self.feedback = None
 
-    def get_next_article(self) -> Article:
+        # the async LLM clients are bound to the loop they first ran on, so keep one for every call
+        self.loop = asyncio.new_event_loop()
+        self.timings = {stage: 0.0 for stage in self.STAGES}
+        self.counts = {stage: 0 for stage in self.STAGES}
+
+    def make_william(self) -> William:
+        return William(model_name=self.model_name, history_tokens=4000, temperature=0.85)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - start
+            self.counts[name] += 1
+
+    def format_timings(self) -> str:
+        timings = [
+            f"{name} {self.timings[name]:.1f}s/{self.counts[name]} (avg {self.timings[name] / max(self.counts[name], 1):.2f}s)"
+            for name in self.STAGES
+        ]
+        if self.gate is not None:
+            timings.append(self.gate.format_stats())
+        return " | ".join(timings)
+
+    async def throttle(self):
+        """Waits until another LLM request may start. The serial loop only ever has one in flight."""
+
+    async def review(self, article: Article) -> str:
+        verdict, similarity = (None, None) if self.gate is None else await asyncio.to_thread(self.gate.check, article.title)
+        if self.gate is not None:
+            self.gate.count_call(saved=verdict is not None)
+        if verdict is not None:
+            return verdict
+        feedback = await self.ask_addison(article)
+        if feedback is None:
+            # a new topic gets William going again, and the gate must not learn from a verdict she didn't give
+            return f"Veto. Addison couldn't review '{article.title}' in time. {REPEAT_ADVICE}"
+        if self.gate is not None:
+            await asyncio.to_thread(self.gate.record, article.title, similarity, "veto" in feedback.lower())
+        return feedback
+
+    async def ask_addison(self, article: Article) -> Optional[str]:
+        return await self.with_retries(lambda: self.addison.awrite_feedback(self.database, article), f"'{article.title}'")
+
+    async def ask_addison_titles(self, titles: list[str]) -> dict[str, str]:
+        feedback = await self.with_retries(lambda: self.addison.areview_titles(self.database, titles), ", ".join(titles))
+        # titles without feedback are vetoed by review_titles
+        return feedback if feedback is not None else {}
+
+    async def with_retries(self, make_review, subject: str):
+        """Addison's review, or None if she timed out `review_attempts` times."""
+        for _ in range(self.review_attempts):
+            await self.throttle()
+            try:
+                with self.stage("review"):
+                    return await asyncio.wait_for(make_review(), self.review_timeout)
+            except asyncio.TimeoutError:
+                print(f"Addison took longer than {self.review_timeout}s to review {subject}")
+        print(f"Addison didn't review {subject} in {self.review_attempts} attempts, vetoing it")
+        return None
+
+    async def review_titles(self, titles: list[str]) -> dict[str, str]:
+        """
+        Feedback on proposed titles, keyed by title: the gate's where it is sure,
+        and Addison's for the rest in one call. Addison isn't asked at all once
+        the gate approves one, so the other titles are missing then. Titles she
+        skipped are vetoed.
+        """
+        verdicts, undecided = {}, {}
+        for title in titles:
+            verdict, similarity = (None, None) if self.gate is None else await asyncio.to_thread(self.gate.check, title)
+            if verdict is None:
+                undecided[title] = similarity
+            else:
+                verdicts[title] = verdict
+        skip_addison = len(undecided) == 0 or any("veto" not in v.lower() for v in verdicts.values())
+        if self.gate is not None:
+            self.gate.count_call(saved=skip_addison)
+        if skip_addison:
+            return verdicts
+
+        feedback = await self.ask_addison_titles(list(undecided))
+        for title, similarity in undecided.items():
+            if title not in feedback:
+                # a title she skipped is vetoed, but the gate must not learn from a verdict she didn't give
+                verdicts[title] = f"Veto. Addison gave no verdict on '{title}'."
+                continue
+            verdicts[title] = feedback[title]
+            if self.gate is not None:
+                await asyncio.to_thread(self.gate.record, title, similarity, "veto" in feedback[title].lower())
+        return verdicts
+
+    async def claim_title(self, title: str) -> bool:
+        """Reserves an approved title before it is written. The serial loop has nobody to share titles with."""
+        return True
+
+    async def plan_article(self, william: William, feedback: Optional[str]) -> tuple[Optional[Article], Optional[str]]:
+        """
+        Has `william` propose titles until one is approved and only writes that
+        one, so a veto costs a few titles instead of a whole article. Returns the
+        article and the feedback on its title, or (None, None) if no title was
+        approved in `max_title_rounds` rounds.
+        """
+        rejected = []
+        for _ in range(self.max_title_rounds):
+            await self.throttle()
+            with self.stage("propose"):
+                titles = await william.apropose_article_titles(feedback, self.title_candidates, "\n".join(rejected))
+            # William has the feedback in his history now
+            feedback = None
+            verdicts = await self.review_titles(titles)
+            for title in titles:
+                verdict = verdicts.get(title)
+                if verdict is None:
+                    continue
+                if "veto" in verdict.lower():
+                    rejected.append(f"{title}: {verdict}")
+                elif not await self.claim_title(title):
+                    rejected.append(f"{title}: Veto. Another writer is already writing about it.")
+                else:
+                    await self.throttle()
+                    with self.stage("write"):
+                        article = await william.awrite_article_on(title)
+                    article.title = title
+                    return article, verdict
+            print(f"Addison vetoed the proposed titles {titles}", end="\n" * 2)
+        return None, None
+
+    async def suggest_backlinks(self, article: Article) -> list[str]:
+        # suggestions are nice to have, so don't hold up the article for them
+        await self.throttle()
+        try:
+            with self.stage("backlinks"):
+                return await asyncio.wait_for(self.brandon.aidentify_backlinks(article.content), self.backlinks_timeout)
+        except asyncio.TimeoutError:
+            print(f"Brandon took longer than {self.backlinks_timeout}s, going on without suggestions")
+            return []
+
+    @staticmethod
+    def add_suggestions(feedback: str, backlinks_opportunities: list[str]) -> str:
+        # supplement feedback from allison with brandon
+        random.shuffle(backlinks_opportunities)
+        feedback += f"\n\nHere's a few suggestions from your friend Brandon for next possible article topics. If you were vetoed by Addison, you should follow one!\n"
+        for i, backlink in enumerate(backlinks_opportunities):
+            feedback += f"({i + 1}) {backlink}\n"
+        return feedback
+
+    def publish(self, article: Article):
+        """Uploads an accepted article and exports it to test_articles."""
+        with self.stage("upload"):
+            if self.uploads is not None:
+                self.uploads.submit(article)
+            else:
+                self.database.upload_article(article, upload_online=False)
+
+        with open(
+            os.path.join("test_articles", f"{article.title}.md"), "w", encoding="utf-8"
+        ) as file:
+            file.write(article.content)
+
+    async def aget_next_article(self) -> Article:
+        article = None
+        if self.title_candidates > 0:
+            article, feedback = await self.plan_article(self.william, self.feedback)
+            # William has the feedback in his history either way
+            self.feedback = None
+        if article is not None:
+            backlinks_opportunities = await self.suggest_backlinks(article)
+            self.feedback = self.add_suggestions(feedback, backlinks_opportunities)
+        else:
+            article, backlinks_opportunities = await self.write_until_approved()
+
+        # export output
+        print(f"William wrote about: {article.title!r}")
+        self.publish(article)
+        print(
+            f"Addison accepted and Brandon suggested {len(backlinks_opportunities)} topics.",
+            end="\n" * 2,
+        )
+        print(self.format_timings(), end="\n" * 2)
+
+        return article
+
+    async def write_until_approved(self) -> tuple[Article, list[str]]:
         addison_vetoes = True
         article = None
         backlinks_opportunities = []
         # Keep trying until Addison okays an article.
         while addison_vetoes:
-            article = self.william.write_new_article(self.feedback)
-            self.feedback = self.addison.write_feedback(self.database, article)
-            backlinks_opportunities = self.brandon.identify_backlinks(article.content)
+            await self.throttle()
+            with self.stage("write"):
+                article = await self.william.awrite_new_article(self.feedback)
+            # Addison and Brandon look at the same article independently, so ask both at once
+            self.feedback, backlinks_opportunities = await asyncio.gather(
+                self.review(article), self.suggest_backlinks(article)
+            )
             addison_vetoes = "veto" in self.feedback.lower()
 
-            # supplement feedback from allison with brandon
-            random.shuffle(backlinks_opportunities)
-            self.feedback += f"\n\nHere's a few suggestions from your friend Brandon for next possible article topics. If you were vetoed by Addison, you should follow one!\n"
-            for i, backlink in enumerate(backlinks_opportunities):
-                self.feedback += f"({i + 1}) {backlink}\n"
+            self.feedback = self.add_suggestions(self.feedback, backlinks_opportunities)
             if addison_vetoes:
                 print(
                     f"Addison vetoed '{article.title}' and Brandon suggested {len(backlinks_opportunities)} topics.",
@@ -47,17 +254,13 @@ class Manager:
                 )
 
         assert article is not None
-        # export output
-        print(f"William wrote about: {article.title!r}")
-        self.database.upload_article(article, upload_online=self.upload_online)
-        print(
-            f"Addison accepted and Brandon suggested {len(backlinks_opportunities)} topics.",
-            end="\n" * 2,
-        )
+        return article, backlinks_opportunities
 
-        with open(
-            os.path.join("test_articles", f"{article.title}.md"), "w", encoding="utf-8"
-        ) as file:
-            file.write(article.content)
+    def get_next_article(self) -> Article:
+        return self.loop.run_until_complete(self.aget_next_article())
 
-        return article
+    def close(self):
+        """Waits for background uploads to finish."""
+        if self.uploads is not None:
+            self.uploads.flush()
+        self.loop.close()
@@ -0,0 +1,200 @@
+import asyncio
+import collections
+import time
+from typing import Optional
+
+from database import Database
+from manager import Manager
+from title_index import title_key
+from william import William
+
+
+class RequestLimiter:
+    """Lets at most `requests_per_minute` LLM requests start in any 60 second window."""
+
+    def __init__(self, requests_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.started = collections.deque()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        # waiting while holding the lock makes callers take turns in arrival order
+        async with self.lock:
+            now = time.monotonic()
+            while len(self.started) > 0 and now - self.started[0] >= 60.0:
+                self.started.popleft()
+            if len(self.started) >= self.requests_per_minute:
+                await asyncio.sleep(self.started[0] + 60.0 - now)
+                self.started.popleft()
+            self.started.append(time.monotonic())
+
+
+class TopicClaims:
+    """Titles being written or reviewed right now, so no two writers publish the same topic."""
+
+    def __init__(self, database: Database):
+        self.database = database
+        self.claimed: dict[str, str] = {}
+
+    async def claim(self, title: str) -> bool:
+        """Claims `title` unless another writer holds it or it is already in the database, both by title_key."""
+        key = title_key(title)
+        if key in self.claimed:
+            return False
+        # an upload thread may hold the title lock, so don't wait for it on the event loop
+        existing = await asyncio.to_thread(self.database.equivalent_title, title)
+        if existing is not None or key in self.claimed:
+            return False
+        self.claimed[key] = title
+        return True
+
+    def release(self, title: str):
+        self.claimed.pop(title_key(title), None)
+
+    def titles(self) -> list[str]:
+        return list(self.claimed.values())
+
+
+class Writer:
+    """One William with its own history and the feedback that arrived for it since its last article."""
+
+    def __init__(self, name: str, william: William, max_unreviewed=1):
+        self.name = name
+        self.william = william
+        self.feedback: Optional[str] = None
+        # a writer only gets ahead of its reviews by this many articles
+        self.unreviewed = asyncio.Semaphore(max_unreviewed)
+
+    def give_feedback(self, feedback: str):
+        self.feedback = feedback if self.feedback is None else f"{self.feedback}\n\n{feedback}"
+
+    def take_feedback(self) -> Optional[str]:
+        feedback, self.feedback = self.feedback, None
+        return feedback
+
+
+class Pipeline(Manager):
+    """
+    Pipelined article generation. `writers` Williams write concurrently into a
+    bounded review queue, `reviewers` workers run Addison (unless she already
+    approved the title, see Manager.plan_article) and Brandon on each article
+    and hand accepted ones to the upload stage through a second bounded queue.
+    A full queue stalls the stage in front of it, and every LLM request waits
+    for the shared RequestLimiter. Writers claim their title before it is
+    reviewed, and a title someone else holds sends the writer back with
+    feedback instead of to Addison.
+
+        pipeline = Pipeline(writers=4, reviewers=2, requests_per_minute=500)
+        pipeline.run()
+    """
+
+    def __init__(self, model_name="gpt-4o-mini", upload_online=False, writers=4, reviewers=2, max_queued=4,
+                 requests_per_minute=500, **kwargs):
+        super().__init__(model_name, upload_online, **kwargs)
+        self.n_reviewers = reviewers
+        self.max_queued = max_queued
+        self.limiter = RequestLimiter(requests_per_minute)
+        self.claims = TopicClaims(self.database)
+        self.writers = [Writer(f"William {i + 1}", self.william if i == 0 else self.make_william())
+                        for i in range(writers)]
+
+        self.written = 0
+        self.accepted = 0
+        self.vetoed = 0
+        self.collisions = 0
+
+    async def throttle(self):
+        await self.limiter.acquire()
+
+    def claim_feedback(self, title: str) -> str:
+        others = ", ".join(f"'{t}'" for t in self.claims.titles())
+        return (f"VETO: '{title}' has already been written or is being written by another writer. "
+                f"Pick a different topic. Topics taken by other writers right now: {others}")
+
+    async def claim_title(self, title: str) -> bool:
+        if await self.claims.claim(title):
+            return True
+        self.collisions += 1
+        return False
+
+    async def write(self, writer: Writer):
+        while True:
+            await writer.unreviewed.acquire()
+            article, verdict = None, None
+            if self.title_candidates > 0:
+                # the title is approved and claimed before anything is written
+                article, verdict = await self.plan_article(writer.william, writer.take_feedback())
+            if article is None:
+                # no approved title, or titles aren't proposed at all: write first and review after
+                await self.throttle()
+                with self.stage("write"):
+                    article = await writer.william.awrite_new_article(writer.take_feedback())
+                if article is None:
+                    writer.unreviewed.release()
+                    continue
+                if not await self.claim_title(article.title):
+                    self.written += 1
+                    writer.give_feedback(self.claim_feedback(article.title))
+                    writer.unreviewed.release()
+                    continue
+            self.written += 1
+            await self.review_queue.put((writer, article, verdict))
+
+    async def review_articles(self):
+        while True:
+            writer, article, verdict = await self.review_queue.get()
+            try:
+                if verdict is None:
+                    feedback, backlinks_opportunities = await asyncio.gather(
+                        self.review(article), self.suggest_backlinks(article)
+                    )
+                else:
+                    # Addison approved the title before it was written
+                    feedback, backlinks_opportunities = verdict, await self.suggest_backlinks(article)
+                addison_vetoes = "veto" in feedback.lower()
+                writer.give_feedback(self.add_suggestions(feedback, backlinks_opportunities))
+            finally:
+                writer.unreviewed.release()
+                self.review_queue.task_done()
+
+            if addison_vetoes:
+                self.vetoed += 1
+                self.claims.release(article.title)
+                print(f"Addison vetoed {writer.name}'s '{article.title}'", end="\n" * 2)
+            else:
+                await self.upload_queue.put(article)
+
+    async def upload_articles(self, articles: Optional[int]):
+        start = time.perf_counter()
+        while articles is None or self.accepted < articles:
+            article = await self.upload_queue.get()
+            # UploadQueue.submit blocks once its own backlog is full
+            await asyncio.to_thread(self.publish, article)
+            self.claims.release(article.title)
+            self.accepted += 1
+            self.upload_queue.task_done()
+
+            per_hour = self.accepted / (time.perf_counter() - start) * 3600
+            print(f"Published '{article.title}' ({self.accepted} accepted, {self.vetoed} vetoed, "
+                  f"{self.collisions} topic collisions, {per_hour:.0f} articles/hour)")
+            print(self.format_timings(), end="\n" * 2)
+
+    async def arun(self, articles: Optional[int] = None):
+        self.review_queue = asyncio.Queue(maxsize=self.max_queued)
+        self.upload_queue = asyncio.Queue(maxsize=self.max_queued)
+        uploader = asyncio.create_task(self.upload_articles(articles))
+        workers = [asyncio.create_task(self.write(writer)) for writer in self.writers]
+        workers += [asyncio.create_task(self.review_articles()) for _ in range(self.n_reviewers)]
+        try:
+            done, _ = await asyncio.wait([uploader, *workers], return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                # re-raises whatever stopped a stage early
+                task.result()
+        finally:
+            for task in [uploader, *workers]:
+                task.cancel()
+            await asyncio.gather(uploader, *workers, return_exceptions=True)
+
+    def run(self, articles: Optional[int] = None):
+        """Generates articles until `articles` have been accepted, or forever."""
+        self.loop.run_until_complete(self.arun(articles))
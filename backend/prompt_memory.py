@@ -0,0 +1,95 @@
+import json
+from collections import deque
+
+from langchain_core.messages import SystemMessage, ToolMessage
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+MESSAGE_OVERHEAD = 4  # tokens the chat format adds around every message
+
+
+class TokenCounter:
+    """Counts message tokens with tiktoken's encoding for `model`, or estimates 4 characters a token without tiktoken."""
+
+    def __init__(self, model="gpt-4o-mini"):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("o200k_base")
+
+    def count_text(self, text: str) -> int:
+        if self.encoding is None:
+            return (len(text) + 3) // 4
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def count(self, message) -> int:
+        text = message.content if isinstance(message.content, str) else json.dumps(message.content)
+        # a written article lives in the arguments of its tool call, not in the content
+        for call in getattr(message, "tool_calls", None) or []:
+            text += call["name"] + json.dumps(call["args"])
+        return self.count_text(text) + MESSAGE_OVERHEAD
+
+
+class PromptMemory:
+    """
+    Chat history under a fixed system prompt, kept within `max_tokens`.
+
+    Messages are counted once when added and the total is kept up to date, so
+    adding and trimming never re-counts the history. The oldest turns are
+    evicted first, together with the tool answers belonging to them, and the
+    titles of evicted articles are kept in a one-line summary after the system
+    prompt. The system message is created once, so every request starts with
+    the same bytes and the provider's prompt cache keeps hitting.
+    """
+
+    def __init__(self, system_prompt: str, max_tokens=8000, counter: TokenCounter = None, summary_titles=50):
+        self.system_message = SystemMessage(content=system_prompt)
+        self.max_tokens = max_tokens
+        self.counter = counter if counter is not None else TokenCounter()
+        self.history: deque = deque()
+        self.counts: deque = deque()
+        self.tokens = 0
+        self.earlier_titles: deque = deque(maxlen=summary_titles)
+        self.summary = None
+
+    def __len__(self):
+        return len(self.history)
+
+    def add(self, message):
+        count = self.counter.count(message)
+        self.history.append(message)
+        self.counts.append(count)
+        self.tokens += count
+        self.trim()
+
+    def _pop(self):
+        self.tokens -= self.counts.popleft()
+        return self.history.popleft()
+
+    def evict(self):
+        """Drops the oldest turn, remembering the title if it was an article."""
+        message = self._pop()
+        for call in getattr(message, "tool_calls", None) or []:
+            if "title" in call["args"]:
+                self.earlier_titles.append(call["args"]["title"])
+                self.summary = None
+        # a tool answer is only valid right after the call it answers
+        while len(self.history) > 0 and isinstance(self.history[0], ToolMessage):
+            self._pop()
+
+    def trim(self):
+        # the newest turn always stays, however long it is
+        while self.tokens > self.max_tokens and any(not isinstance(m, ToolMessage) for m in list(self.history)[1:]):
+            self.evict()
+
+    def messages(self) -> list:
+        """The messages to send: system prompt, summary of evicted articles, then the history."""
+        if self.summary is None and len(self.earlier_titles) > 0:
+            self.summary = SystemMessage(content=f"Earlier articles you wrote, oldest first: {', '.join(self.earlier_titles)}")
+        prefix = [self.system_message] if self.summary is None else [self.system_message, self.summary]
+        return [*prefix, *self.history]
@@ -180,3 +180,21 @@ Here is feedback given by your editor Addison. Addison is your boss: you must fo
 ADDISON_FEEDBACK_PROMPT = (
     lambda title, search_result: f"Williams Article Title:\n{title}\n\nSearch Result in DB:\n{search_result}"
 )
+
+WILLIAM_PROPOSE_TITLES_PROMPT = (
+    lambda n, rejected: f"""Before writing anything, propose {n} different titles for your next article, best first.
+Choose them the way you would choose the topic of a new article, and follow your title rules.
+Only the title Addison approves will be written, so make every candidate a distinct topic."""
+    + (f"\n\nAddison already vetoed these candidates, don't propose them or anything close to them:\n{rejected}" if rejected else "")
+)
+
+WILLIAM_EXPAND_TITLE_PROMPT = (
+    lambda title: f"Addison approved the title '{title}'. Write the article with exactly this title now."
+)
+
+ADDISON_TITLES_PROMPT = (
+    lambda candidates: "William proposes these titles for his next article. Review every one of them on its own, "
+    "answering with the response you would give for an article with that title.\n\n"
+    + "\n\n".join(f"Williams Article Title:\n{title}\n\nSearch Result in DB:\n{search_result}"
+                  for title, search_result in candidates)
+)
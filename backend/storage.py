@@ -0,0 +1,350 @@
+import os
+import sqlite3
+import threading
+
+import bson
+import pymongo
+from bson.objectid import ObjectId
+from pymongo.operations import SearchIndexModel, UpdateOne
+
+# Article storage backends for Database. Both keep MongoDB-shaped documents:
+# dicts with an ObjectId "_id", and backlinks as a list of
+# {"phrase", "article_id"} subdocuments. Every backend implements
+#
+#   insert(document) / insert_many(documents)     raising DuplicateArticleError for known ids or upload ids
+#   find_upload(upload_id)                        id of the document inserted with `upload_id`, or None
+#   get(article_id, fields) / find_title(title, fields)  `fields=None` reads whole documents
+#   iter_documents(fields, batch_size, after_id)  streams in batches, in _id order after `after_id`
+#   find_many(article_ids, fields)                the documents with these ids, in no particular order
+#   sample(n, fields) / find_linking(article_id)
+#   write_backlinks(updates, merge, chunk_size) / update_fields(updates, chunk_size)
+#   bootstrap(...)                                creates whatever indexes are missing
+#
+# and lists the exceptions it raises for unavailable or failing storage in `errors`.
+
+
+class DuplicateArticleError(Exception):
+    pass
+
+
+def open_storage(address: str):
+    """`sqlite:///path/to/file.db` opens an embedded SQLite file, anything else is a MongoDB address."""
+    if address.startswith("sqlite:///"):
+        return SQLiteStorage(address[len("sqlite:///"):])
+    return MongoStorage(address)
+
+
+def project(document: dict, fields) -> dict:
+    if fields is None:
+        return document
+    return {k: v for k, v in document.items() if k == "_id" or k in fields}
+
+
+def projection(fields):
+    return None if fields is None else {f: 1 for f in fields}
+
+
+class MongoStorage:
+    name = "mongodb"
+    errors = (pymongo.errors.PyMongoError,)
+
+    def __init__(self, address: str, database="william", collection="articles"):
+        self.address = address
+        self.client = pymongo.MongoClient(address)
+        self.collection = self.client[database][collection]
+        self.insert_lock = threading.Lock()
+
+    def insert(self, document: dict):
+        """
+        Inserts `document`, returning its id. A missing `_id` is assigned here,
+        under a lock, so ids from this process follow insert order (incremental
+        backlinking relies on that). A document whose `upload_id` is already
+        stored raises DuplicateArticleError through the unique index.
+        """
+        with self.insert_lock:
+            document = {"_id": ObjectId(), **document}
+            try:
+                return self.collection.insert_one(document).inserted_id
+            except pymongo.errors.DuplicateKeyError as e:
+                raise DuplicateArticleError(str(e))
+
+    def find_upload(self, upload_id: str):
+        e = self.collection.find_one({"upload_id": upload_id}, {"_id": 1})
+        return None if e is None else e["_id"]
+
+    def insert_many(self, documents: list[dict]) -> int:
+        """Inserts in one unordered bulk write, skipping documents whose _id is already taken."""
+        if len(documents) == 0:
+            return 0
+        try:
+            return len(self.collection.insert_many(documents, ordered=False).inserted_ids)
+        except pymongo.errors.BulkWriteError as e:
+            duplicates = [w for w in e.details["writeErrors"] if w["code"] == 11000]
+            if len(duplicates) < len(e.details["writeErrors"]):
+                raise
+            return e.details["nInserted"]
+
+    def get(self, article_id, fields):
+        return self.collection.find_one({"_id": ObjectId(article_id)}, projection(fields))
+
+    def find_title(self, title: str, fields=("title",)):
+        return self.collection.find_one({"title": title}, projection(fields))
+
+    def iter_documents(self, fields, batch_size=500, after_id=None):
+        if after_id is None:
+            cursor = self.collection.find({}, projection(fields), batch_size=batch_size)
+        else:
+            cursor = self.collection.find({"_id": {"$gt": ObjectId(after_id)}}, projection(fields),
+                                          batch_size=batch_size).sort("_id", pymongo.ASCENDING)
+        yield from cursor
+
+    def find_many(self, article_ids, fields) -> list[dict]:
+        return list(self.collection.find({"_id": {"$in": [ObjectId(i) for i in article_ids]}}, projection(fields)))
+
+    def sample(self, n: int, fields) -> list[dict]:
+        pipeline = [{"$sample": {"size": n}}]
+        if fields is not None:
+            pipeline.append({"$project": projection(fields)})
+        return list(self.collection.aggregate(pipeline))
+
+    def find_linking(self, article_id) -> list[dict]:
+        return list(self.collection.find({"backlinks.article_id": ObjectId(article_id)}, {"title": 1}))
+
+    @staticmethod
+    def merge_backlinks_update(article_id, backlinks: list[dict]) -> UpdateOne:
+        """
+        An update that merges `backlinks` into the stored ones on the server:
+        stored entries for the same phrases are replaced, all others are kept.
+        """
+        phrases = [b["phrase"] for b in backlinks]
+        kept = {"$filter": {
+            "input": {"$cond": [{"$isArray": "$backlinks"}, "$backlinks", []]},
+            "cond": {"$not": [{"$in": ["$$this.phrase", {"$literal": phrases}]}]},
+        }}
+        merged = {"$concatArrays": [kept, {"$literal": backlinks}]}
+        return UpdateOne({"_id": ObjectId(article_id)}, [{"$set": {"backlinks": merged}}])
+
+    def bulk_write(self, operations: list, chunk_size: int, what: str):
+        for start in range(0, len(operations), chunk_size):
+            try:
+                self.collection.bulk_write(operations[start:start + chunk_size], ordered=False)
+            except pymongo.errors.BulkWriteError as e:
+                print(f"MongoDB bulk write error: {len(e.details['writeErrors'])} {what} failed")
+
+    def write_backlinks(self, updates: list[tuple], merge=False, chunk_size=1000):
+        """`updates` are (article id, backlink subdocuments) pairs, written as unordered bulk writes."""
+        if merge:
+            operations = [self.merge_backlinks_update(article_id, backlinks) for article_id, backlinks in updates]
+        else:
+            operations = [UpdateOne({"_id": ObjectId(article_id)}, {"$set": {"backlinks": backlinks}})
+                          for article_id, backlinks in updates]
+        self.bulk_write(operations, chunk_size, "backlink updates")
+
+    def update_fields(self, updates: list[tuple], chunk_size=1000):
+        """`updates` are (article id, fields to set, field names to remove) triples."""
+        operations = []
+        for article_id, values, removed in updates:
+            update = {"$set": values}
+            if len(removed) > 0:
+                update["$unset"] = {field: "" for field in removed}
+            operations.append(UpdateOne({"_id": ObjectId(article_id)}, update))
+        self.bulk_write(operations, chunk_size, "updates")
+
+    def bootstrap(self, vector_index_name: str, vector_index_definition: dict, same_fields, debug_messages=False):
+        """
+        Creates the title and backlinks.article_id indexes and the Atlas vector
+        index if they are missing, and updates the vector index if its fields
+        differ from `vector_index_definition`.
+        """
+        self.collection.create_index("title")
+        self.collection.create_index("backlinks.article_id")
+        self.collection.create_index("upload_id", unique=True, sparse=True)
+        existing = {index["name"]: index for index in self.collection.list_search_indexes()}
+        if vector_index_name not in existing:
+            self.collection.create_search_index(
+                SearchIndexModel(name=vector_index_name, definition=vector_index_definition, type="vectorSearch")
+            )
+            print(f"Created search index {vector_index_name!r}, Atlas builds it in the background")
+        elif not same_fields(existing[vector_index_name].get("latestDefinition", {}), vector_index_definition):
+            self.collection.update_search_index(vector_index_name, vector_index_definition)
+            print(f"Updated search index {vector_index_name!r}")
+        elif debug_messages:
+            print(f"Search index {vector_index_name!r} already exists")
+
+
+class SQLiteStorage:
+    """
+    Embedded single-file storage for single-node deployments and benchmarks
+    without a cluster. Title and content are columns (the title one indexed),
+    backlinks live in their own table indexed by target, and every other
+    field, embeddings included, is kept as one BSON blob that is only decoded
+    when one of its fields is asked for.
+    """
+
+    name = "sqlite"
+    errors = (sqlite3.Error,)
+    columns = ("title", "content")
+
+    def __init__(self, path: str):
+        self.address = f"sqlite:///{path}"
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.RLock()  # uploads and backlinking may share the connection across threads
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS articles (id TEXT PRIMARY KEY, title TEXT, content TEXT, extra BLOB);
+                CREATE INDEX IF NOT EXISTS articles_title ON articles (title);
+                CREATE TABLE IF NOT EXISTS backlinks (
+                    article_id TEXT, phrase TEXT, target_id TEXT, PRIMARY KEY (article_id, phrase)
+                );
+                CREATE INDEX IF NOT EXISTS backlinks_target ON backlinks (target_id);
+            """)
+            # files created before uploads were tagged lack the column
+            if "upload_id" not in [c[1] for c in self.connection.execute("PRAGMA table_info(articles)")]:
+                self.connection.execute("ALTER TABLE articles ADD COLUMN upload_id TEXT")
+            self.connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS articles_upload ON articles (upload_id)")
+
+    def row(self, document: dict) -> tuple:
+        extra = {k: v for k, v in document.items() if k not in ("_id", "backlinks", "upload_id", *self.columns)}
+        return str(document["_id"]), document.get("title"), document.get("content"), bson.encode(extra)
+
+    def _insert(self, document: dict):
+        # the id is assigned under the lock, so ids follow insert order
+        document = {"_id": ObjectId(), **document}
+        self.connection.execute("INSERT INTO articles (id, title, content, extra, upload_id) VALUES (?, ?, ?, ?, ?)",
+                                (*self.row(document), document.get("upload_id")))
+        if document.get("backlinks"):
+            self._replace_backlinks(document["_id"], document["backlinks"])
+        return document["_id"]
+
+    def insert(self, document: dict):
+        """Inserts `document`, returning its id; a known `upload_id` raises DuplicateArticleError."""
+        try:
+            with self.lock, self.connection:
+                return self._insert(document)
+        except sqlite3.IntegrityError as e:
+            raise DuplicateArticleError(str(e))
+
+    def find_upload(self, upload_id: str):
+        with self.lock:
+            row = self.connection.execute("SELECT id FROM articles WHERE upload_id = ?", (upload_id,)).fetchone()
+        return None if row is None else ObjectId(row[0])
+
+    def insert_many(self, documents: list[dict]) -> int:
+        """Inserts in a single transaction, skipping documents whose _id is already taken."""
+        inserted = 0
+        with self.lock, self.connection:
+            for document in documents:
+                try:
+                    self._insert(document)
+                    inserted += 1
+                except sqlite3.IntegrityError:
+                    pass
+        return inserted
+
+    def documents(self, rows: list[tuple], fields) -> list[dict]:
+        """Documents for (id, title, content, extra) rows, with just `fields`."""
+        documents = []
+        for article_id, title, content, extra in rows:
+            document = {"_id": ObjectId(article_id), "title": title, "content": content}
+            if extra is not None:
+                document.update(bson.decode(extra))
+            documents.append(project(document, fields))
+        if (fields is None or "backlinks" in fields) and len(documents) > 0:
+            backlinks = {str(d["_id"]): [] for d in documents}
+            placeholders = ",".join("?" * len(backlinks))
+            for article_id, phrase, target_id in self.connection.execute(
+                    f"SELECT article_id, phrase, target_id FROM backlinks WHERE article_id IN ({placeholders})",
+                    list(backlinks)):
+                backlinks[article_id].append({"phrase": phrase, "article_id": ObjectId(target_id)})
+            for document in documents:
+                document["backlinks"] = backlinks[str(document["_id"])]
+        return documents
+
+    def select(self, fields) -> str:
+        # the blob is only read if a field outside the columns is wanted
+        needs_extra = fields is None or any(f not in ("_id", "backlinks", *self.columns) for f in fields)
+        return f"SELECT id, title, content, {'extra' if needs_extra else 'NULL'} FROM articles"
+
+    def get(self, article_id, fields):
+        with self.lock:
+            rows = self.connection.execute(f"{self.select(fields)} WHERE id = ?", (str(article_id),)).fetchall()
+            documents = self.documents(rows, fields)
+        return documents[0] if documents else None
+
+    def find_title(self, title: str, fields=("title",)):
+        with self.lock:
+            rows = self.connection.execute(f"{self.select(fields)} WHERE title = ? LIMIT 1", (title,)).fetchall()
+            documents = self.documents(rows, fields)
+        return documents[0] if documents else None
+
+    def iter_documents(self, fields, batch_size=500, after_id=None):
+        # keyset pagination, so writes between batches can't disturb the scan
+        position = "" if after_id is None else str(after_id)
+        while True:
+            with self.lock:
+                rows = self.connection.execute(f"{self.select(fields)} WHERE id > ? ORDER BY id LIMIT ?",
+                                               (position, batch_size)).fetchall()
+                documents = self.documents(rows, fields)
+            if len(rows) == 0:
+                return
+            yield from documents
+            position = rows[-1][0]
+
+    def find_many(self, article_ids, fields) -> list[dict]:
+        article_ids = [str(i) for i in article_ids]
+        if len(article_ids) == 0:
+            return []
+        with self.lock:
+            rows = self.connection.execute(f"{self.select(fields)} WHERE id IN ({','.join('?' * len(article_ids))})",
+                                           article_ids).fetchall()
+            return self.documents(rows, fields)
+
+    def sample(self, n: int, fields) -> list[dict]:
+        with self.lock:
+            rows = self.connection.execute(f"{self.select(fields)} ORDER BY RANDOM() LIMIT ?", (n,)).fetchall()
+            return self.documents(rows, fields)
+
+    def find_linking(self, article_id) -> list[dict]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT DISTINCT articles.id, articles.title FROM backlinks JOIN articles ON articles.id = backlinks.article_id "
+                "WHERE backlinks.target_id = ?", (str(article_id),)).fetchall()
+        return [{"_id": ObjectId(i), "title": title} for i, title in rows]
+
+    def _replace_backlinks(self, article_id, backlinks: list[dict], merge=False):
+        if not merge:
+            self.connection.execute("DELETE FROM backlinks WHERE article_id = ?", (str(article_id),))
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO backlinks VALUES (?, ?, ?)",
+            [(str(article_id), b["phrase"], str(b["article_id"])) for b in backlinks],
+        )
+
+    def write_backlinks(self, updates: list[tuple], merge=False, chunk_size=1000):
+        """`updates` are (article id, backlink subdocuments) pairs; each chunk is one transaction."""
+        for start in range(0, len(updates), chunk_size):
+            with self.lock, self.connection:
+                for article_id, backlinks in updates[start:start + chunk_size]:
+                    self._replace_backlinks(article_id, backlinks, merge)
+
+    def update_fields(self, updates: list[tuple], chunk_size=1000):
+        """`updates` are (article id, fields to set, field names to remove) triples."""
+        for start in range(0, len(updates), chunk_size):
+            with self.lock, self.connection:
+                for article_id, values, removed in updates[start:start + chunk_size]:
+                    row = self.connection.execute("SELECT title, content, extra FROM articles WHERE id = ?",
+                                                  (str(article_id),)).fetchone()
+                    if row is None:
+                        continue
+                    document = {"_id": article_id, "title": row[0], "content": row[1]}
+                    document.update(bson.decode(row[2]) if row[2] else {})
+                    document.update(values)
+                    for field in removed:
+                        document.pop(field, None)
+                    self.connection.execute("UPDATE articles SET title = ?, content = ?, extra = ? WHERE id = ?",
+                                            (*self.row(document)[1:], str(article_id)))
+
+    def bootstrap(self, *args, **kwargs):
+        pass  # the schema and its indexes are created when the file is opened
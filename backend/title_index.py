@@ -0,0 +1,202 @@
+import bisect
+import heapq
+import math
+import re
+from collections import defaultdict
+
+import numpy as np
+
+from ann_index import ExactIndex
+
+# words too common in titles to say anything about a match
+STOPWORDS = {"a", "an", "and", "as", "at", "by", "for", "from", "in", "into", "is", "of", "on", "or", "the", "to",
+             "with"}
+
+
+def title_tokens(text: str) -> set[str]:
+    return {w for w in re.findall(r"\w+", text.lower()) if w not in STOPWORDS}
+
+
+def title_key(text: str) -> str:
+    """Equal for titles with the same words, whatever their case, order, punctuation or stopwords."""
+    return " ".join(sorted(title_tokens(text)))
+
+
+class TitleRegistry:
+    """
+    Titles and ids of all articles, and nothing else, with O(1) exact lookups,
+    prefix lookups through a sorted list of lower-cased titles, and an inverted
+    index from title words to titles ranked by the summed idf of the words a
+    title shares with the query.
+    """
+
+    def __init__(self):
+        self.titles: list[str] = []
+        self.uids: list = []
+        self.rows: dict[str, int] = {}
+        self.postings: dict[str, set[int]] = defaultdict(set)
+        self.sorted_titles: list[tuple[str, int]] = []  # (lower-cased title, row), sorted
+        self.keys: dict[str, int] = {}  # title_key of each title, to its first row
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __contains__(self, title: str):
+        return title in self.rows
+
+    def get(self, title: str):
+        """The id stored with `title`, or None."""
+        row = self.rows.get(title)
+        return None if row is None else self.uids[row]
+
+    def _append(self, title: str, uid) -> tuple[int, bool]:
+        """Adds `title` to everything but sorted_titles; returns its row and whether it is new."""
+        if title in self.rows:
+            row = self.rows[title]
+            self.uids[row] = uid if uid is not None else self.uids[row]
+            return row, False
+        row = len(self.titles)
+        self.rows[title] = row
+        self.titles.append(title)
+        self.uids.append(uid)
+        for token in title_tokens(title):
+            self.postings[token].add(row)
+        key = title_key(title)
+        if key:
+            self.keys.setdefault(key, row)
+        return row, True
+
+    def add(self, title: str, uid=None) -> int:
+        """Adds `title`, or updates its id."""
+        row, new = self._append(title, uid)
+        if new:
+            bisect.insort(self.sorted_titles, (title.lower(), row))
+        return row
+
+    def add_many(self, titles: list[str], uids=None):
+        uids = uids if uids is not None else [None] * len(titles)
+        added = []
+        for title, uid in zip(titles, uids):
+            row, new = self._append(title, uid)
+            if new:
+                added.append((title.lower(), row))
+        # one sort instead of an insort per title, which made warm-loading quadratic
+        self.sorted_titles.extend(added)
+        self.sorted_titles.sort()
+
+    def equivalent(self, title: str):
+        """A stored title with the same words as `title` (see title_key), or None."""
+        row = self.keys.get(title_key(title))
+        return None if row is None else self.titles[row]
+
+    def prefix_search(self, prefix: str, k=10) -> list[str]:
+        """Up to `k` titles starting with `prefix`, ignoring case, in alphabetical order."""
+        prefix = prefix.lower()
+        matches = []
+        for title, row in self.sorted_titles[bisect.bisect_left(self.sorted_titles, (prefix, -1)):]:
+            if not title.startswith(prefix) or len(matches) == k:
+                break
+            matches.append(self.titles[row])
+        return matches
+
+    def token_search(self, query: str, k=10) -> list[tuple[str, float]]:
+        scores = defaultdict(float)
+        for token in title_tokens(query):
+            rows = self.postings.get(token, ())
+            idf = math.log(1 + len(self.titles) / max(len(rows), 1))
+            for row in rows:
+                scores[row] += idf
+        best = heapq.nsmallest(k, scores.items(), key=lambda s: (-s[1], s[0]))
+        return [(self.titles[row], score) for row, score in best]
+
+    def search(self, query: str, query_embedding=None, k=10) -> list[str]:
+        return [title for title, _ in self.token_search(query, k)]
+
+
+class TitleIndex:
+    """
+    In-process cosine search over title embeddings. Kept apart from the
+    TitleRegistry, so only deployments that search titles by meaning hold the
+    vectors (6 KB per title as float32); titles without an embedding are
+    simply not in here.
+    """
+
+    def __init__(self, min_similarity=0.85):
+        self.min_similarity = min_similarity
+        self.vectors = None  # ExactIndex over the embedded titles, created with the first embedding
+        self.titles: list[str] = []  # title of each row in `vectors`
+        self.embedded: set[str] = set()
+
+    def __len__(self):
+        return len(self.titles)
+
+    def add(self, title: str, embedding):
+        self.add_many([title], [embedding])
+
+    def add_many(self, titles: list[str], embeddings):
+        """Adds the titles whose embedding isn't None and that aren't in here yet."""
+        new_titles, new_vectors = [], []
+        for title, embedding in zip(titles, embeddings):
+            if embedding is not None and title not in self.embedded:
+                self.embedded.add(title)
+                new_titles.append(title)
+                new_vectors.append(np.asarray(embedding, dtype=np.float32))
+
+        if len(new_vectors) > 0:
+            vectors = np.stack(new_vectors)
+            if self.vectors is None:
+                self.vectors = ExactIndex(vectors.shape[1])
+            self.vectors.add(vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12))
+            self.titles.extend(new_titles)
+
+    def vector_search(self, query_embedding, k=10, min_similarity=None) -> list[tuple[str, float]]:
+        """Up to `k` (title, cosine similarity) pairs at or above `min_similarity`, which defaults to the index's."""
+        if self.vectors is None:
+            return []
+        min_similarity = self.min_similarity if min_similarity is None else min_similarity
+        query = np.asarray(query_embedding, dtype=np.float32)[None, :]
+        similarities, ids = self.vectors.search(query / max(np.linalg.norm(query), 1e-12), k)
+        return [(self.titles[i], float(s)) for s, i in zip(similarities[0], ids[0]) if i >= 0 and s >= min_similarity]
+
+    def search(self, query: str, query_embedding=None, k=10) -> list[str]:
+        if query_embedding is None:
+            return []
+        return [title for title, _ in self.vector_search(query_embedding, k)]
+
+
+class AtlasTitleSearch:
+    """Title search through the Atlas `vector_index` on `title_embedding`, for corpora too big to hold in process."""
+
+    def __init__(self, collection, index_name="vector_index", num_candidates=100, min_similarity=0.85, encode_query=list):
+        self.collection = collection
+        self.encode_query = encode_query
+        self.index_name = index_name
+        self.num_candidates = num_candidates
+        self.min_similarity = min_similarity
+
+    def add_many(self, titles: list[str], embeddings):
+        pass  # the vector index picks up stored documents by itself
+
+    def add(self, title: str, embedding):
+        pass
+
+    def vector_search(self, query_embedding, k=10, min_similarity=None) -> list[tuple[str, float]]:
+        min_similarity = self.min_similarity if min_similarity is None else min_similarity
+        cursor = self.collection.aggregate([
+            {"$vectorSearch": {
+                "index": self.index_name,
+                "path": "title_embedding",
+                "queryVector": self.encode_query(query_embedding),
+                "numCandidates": max(self.num_candidates, k),
+                "limit": k,
+            }},
+            {"$project": {"title": 1, "score": {"$meta": "vectorSearchScore"}}},
+        ])
+        # vectorSearchScore maps dotProduct and cosine similarity s to (1 + s) / 2
+        matches = [(e["title"], 2 * e["score"] - 1) for e in cursor]
+        return [(title, similarity) for title, similarity in matches if similarity >= min_similarity]
+
+    def search(self, query: str, query_embedding=None, k=10) -> list[str]:
+        if query_embedding is None:
+            return []
+        return [title for title, _ in self.vector_search(query_embedding, k)]
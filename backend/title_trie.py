@@ -0,0 +1,93 @@
+from collections import deque
+
+
+class TitleAutomaton:
+    """
+    Aho–Corasick automaton over lower-cased title words.
+
+    Finds every verbatim, case-insensitive occurrence of any title in a list of
+    words in a single pass, no matter how many words the titles have. Titles can
+    be added at any time; failure links are rebuilt lazily on the next search.
+    """
+
+    def __init__(self, titles=(), tokenizer=None):
+        self.tokenizer = tokenizer if tokenizer is not None else str.split
+        self.goto: list[dict[str, int]] = [{}]
+        self.depth: list[int] = [0]
+        self.titles: list[list[str]] = [[]]  # titles ending at each node
+        self.fail: list[int] = [0]
+        self.output_link: list[int] = [0]  # closest node on the failure chain that ends a title
+        self.built = True
+        for title in titles:
+            self.add(title)
+
+    def __len__(self):
+        return sum(len(t) for t in self.titles)
+
+    def add(self, title: str):
+        words = [w.lower() for w in self.tokenizer(title) if w != ""]
+        if len(words) == 0:
+            return
+        node = 0
+        for word in words:
+            if word not in self.goto[node]:
+                self.goto.append({})
+                self.depth.append(self.depth[node] + 1)
+                self.titles.append([])
+                self.goto[node][word] = len(self.goto) - 1
+            node = self.goto[node][word]
+        self.titles[node].append(title)
+        self.built = False
+
+    def build(self):
+        self.fail = [0] * len(self.goto)
+        self.output_link = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for word, child in self.goto[node].items():
+                fallback = self.fail[node]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(word, 0)
+                self.output_link[child] = self.fail[child] if self.titles[self.fail[child]] else self.output_link[self.fail[child]]
+                queue.append(child)
+        self.built = True
+
+    def find_all(self, words: list[str]) -> list[tuple[int, int, list[str]]]:
+        """Returns (start, end, titles) for every occurrence, overlapping ones included."""
+        if not self.built:
+            self.build()
+        matches = []
+        node = 0
+        for i, word in enumerate(words):
+            word = word.lower()
+            while node and word not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(word, 0)
+            out = node if self.titles[node] else self.output_link[node]
+            while out:
+                matches.append((i + 1 - self.depth[out], i + 1, self.titles[out]))
+                out = self.output_link[out]
+        return matches
+
+    def find(self, words: list[str], exclude_title=None) -> list[tuple[int, int, str]]:
+        """
+        Returns non-overlapping (start, end, title) spans, preferring the leftmost
+        and then the longest occurrence. If several titles only differ in case,
+        the one added last wins. `exclude_title` is never matched.
+        """
+        candidates = []
+        for start, end, titles in self.find_all(words):
+            titles = [t for t in titles if t != exclude_title]
+            if len(titles) > 0:
+                candidates.append((start, end, titles[-1]))
+        candidates.sort(key=lambda m: (m[0], m[0] - m[1]))
+
+        spans = []
+        position = 0
+        for start, end, title in candidates:
+            if start >= position:
+                spans.append((start, end, title))
+                position = end
+        return spans
@@ -0,0 +1,105 @@
+import json
+import os
+import queue
+import threading
+import time
+
+from bson.objectid import ObjectId
+
+from database import Article, Database
+
+UPLOAD_SPOOL_DIR = "upload_spool"
+
+
+class UploadQueue:
+    """
+    Write-behind uploads for `Database.upload_article`.
+
+    `submit` spools the article to disk, makes its title visible to
+    `query_titles` and returns immediately; `workers` background threads then
+    do the embedding, image lookup and insert. At most `max_pending` uploads
+    wait at a time, after which `submit` blocks. Every article gets an upload
+    id before it is spooled, which is stored with the document, and its spool
+    file is only removed once the insert went through, so articles left over
+    from a crash are uploaded on the next start without ever being inserted
+    twice. The document `_id` itself is left to the storage, so ids keep
+    following insert order for incremental backlinking.
+    """
+
+    def __init__(self, database: Database, spool_dir=UPLOAD_SPOOL_DIR, workers=4, max_pending=32, max_attempts=3,
+                 retry_delay=5.0, debug_messages=False):
+        self.database = database
+        self.spool_dir = spool_dir
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.debug_messages = debug_messages
+        self.pending: queue.Queue = queue.Queue(maxsize=max_pending)
+        self.uploaded = 0
+        self.failed = 0
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+        self.recover()
+
+    def _spool_path(self, upload_id: str) -> str:
+        return os.path.join(self.spool_dir, f"{upload_id}.json")
+
+    def _write_spool(self, upload_id: str, article: Article):
+        path = self._spool_path(upload_id)
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump({"upload_id": upload_id, "title": article.title, "content": article.content}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+
+    def recover(self) -> int:
+        """Re-queues articles spooled by an earlier run that never finished uploading."""
+        # upload ids are ObjectId strings, which start with their creation time, so sorting keeps submission order
+        names = sorted(n for n in os.listdir(self.spool_dir) if n.endswith(".json"))
+        for name in names:
+            with open(os.path.join(self.spool_dir, name), "r", encoding="utf-8") as file:
+                entry = json.load(file)
+            article = Article(entry["title"], entry["content"])
+            self.database.note_title(article)
+            self.pending.put((entry.get("upload_id", entry.get("_id")), article))
+        if len(names) > 0:
+            print(f"Recovered {len(names)} spooled article uploads")
+        return len(names)
+
+    def submit(self, article: Article):
+        upload_id = str(ObjectId())
+        self._write_spool(upload_id, article)
+        self.database.note_title(article)
+        self.pending.put((upload_id, article))
+
+    def _work(self):
+        while True:
+            upload_id, article = self.pending.get()
+            try:
+                self._upload(upload_id, article)
+            finally:
+                self.pending.task_done()
+
+    def _upload(self, upload_id: str, article: Article):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                uid = self.database.upload_article(article, upload_id=upload_id)
+            except Exception as e:
+                print(f"Uploading '{article.title}' failed: {e}")
+                uid = None
+            if uid is not None:
+                os.remove(self._spool_path(upload_id))
+                self.uploaded += 1
+                if self.debug_messages:
+                    print(f"Uploaded '{article.title}' in the background")
+                return
+            if attempt < self.max_attempts:
+                time.sleep(self.retry_delay * attempt)
+        self.failed += 1
+        print(f"Giving up on uploading '{article.title}' for now, it stays spooled for the next start")
+
+    def flush(self):
+        """Blocks until every submitted upload has finished or been given up on."""
+        self.pending.join()
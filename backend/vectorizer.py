@@ -0,0 +1,226 @@
+import hashlib
+import os
+import queue
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from embedding_store import EmbeddingStore
+
+try:
+    import openai
+    from openai import OpenAI
+except ImportError:
+    openai = None
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_DIM = 1536
+EMBEDDING_CACHE_DIR = "embedding_cache"
+
+if openai is not None:
+    RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError,
+                        openai.InternalServerError)
+else:
+    RETRYABLE_ERRORS = (ConnectionError, TimeoutError)
+
+
+class OpenAIEmbeddingBackend:
+    """Embeddings from the OpenAI API; one HTTP request per call, however many texts."""
+
+    max_batch_size = 2048  # inputs per request accepted by the embeddings endpoint
+
+    def __init__(self, model=EMBEDDING_MODEL):
+        if openai is None:
+            raise ImportError("The 'openai' embedding backend needs the openai package (pip install openai)")
+        self.client = OpenAI()
+        self.model = model
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        response = self.client.embeddings.create(model=self.model, input=texts)
+        return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+
+
+class LocalEmbeddingBackend:
+    """
+    Offline stand-in for the OpenAI backend. Hashes every lower-cased word into
+    one of `dim` buckets, so texts sharing words get similar unit vectors, and
+    needs neither network access nor an API key.
+    """
+
+    max_batch_size = 2048
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self.model = f"local-hash-{dim}"
+
+    def embed_one(self, text: str) -> list[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[0], norm = 1.0, 1.0
+        return (vector / norm).tolist()
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_one(t) for t in texts]
+
+
+EMBEDDING_BACKENDS = {
+    "openai": OpenAIEmbeddingBackend,
+    "local": LocalEmbeddingBackend,
+}
+
+
+class EmbeddingCoalescer:
+    """
+    Groups concurrent embedding requests into shared backend calls.
+
+    Callers `submit` their texts and get a Future back. A single background
+    thread takes everything that arrives within `max_wait` seconds of the first
+    pending request (or while the previous call is still in flight), up to
+    `max_batch_size` texts, and answers all of them with one call to `embed_fn`.
+    """
+
+    def __init__(self, embed_fn, max_batch_size=2048, max_wait=0.005):
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests: queue.Queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, texts: list[str]) -> Future:
+        future = Future()
+        if len(texts) == 0:
+            future.set_result([])
+        else:
+            self.requests.put((list(texts), future))
+        return future
+
+    def _next_batch(self) -> list[tuple[list[str], Future]]:
+        batch = [self.requests.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            try:
+                texts, future = self.requests.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            batch.append((texts, future))
+            size += len(texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            unique = list(dict.fromkeys(t for texts, _ in batch for t in texts))
+            try:
+                vectors = dict(zip(unique, self.embed_fn(unique)))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for texts, future in batch:
+                future.set_result([vectors[t] for t in texts])
+
+
+class Vectorizer:
+    """
+    Text embeddings for articles.
+
+    `backend` is "openai" (text-embedding-ada-002) or "local" (an offline
+    stand-in), defaulting to the EMBEDDING_BACKEND environment variable. Calls
+    are split into requests of at most the backend's batch size and retried
+    with exponential backoff on rate limits and connection errors. With
+    `coalesce`, concurrent callers share requests through an EmbeddingCoalescer.
+
+    Results are cached on disk under `cache_dir` by model name and sha256 of
+    the text, so re-uploaded or regenerated texts are never embedded twice.
+    The cache keeps at most `cache_max_entries` vectors, evicting the least
+    recently used; pass `cache_dir=None` to disable it.
+    """
+
+    def __init__(self, backend=None, coalesce=True, max_retries=5, backoff=1.0, max_backoff=30.0,
+                 max_wait=0.005, cache_dir=EMBEDDING_CACHE_DIR, cache_dtype="float16", cache_max_entries=200_000,
+                 debug_messages=False):
+        backend = backend or os.getenv("EMBEDDING_BACKEND", "openai")
+        if isinstance(backend, str):
+            if backend not in EMBEDDING_BACKENDS:
+                raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {', '.join(EMBEDDING_BACKENDS)}")
+            backend = EMBEDDING_BACKENDS[backend]()
+        self.backend = backend
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.debug_messages = debug_messages
+        self.request_count = 0
+
+        self.coalescer = None
+        if coalesce:
+            self.coalescer = EmbeddingCoalescer(self._embed, self.backend.max_batch_size, max_wait)
+
+        self.cache = None
+        self.cache_lock = threading.Lock()
+        if cache_dir is not None:
+            self.cache = EmbeddingStore(cache_dir, self.backend.model, dtype=cache_dtype, hash_keys=True,
+                                        max_entries=cache_max_entries, lru_size=min(10_000, cache_max_entries))
+
+    @property
+    def cache_hits(self) -> int:
+        return self.cache.hits if self.cache is not None else 0
+
+    @property
+    def cache_misses(self) -> int:
+        return self.cache.misses if self.cache is not None else 0
+
+    def _request(self, texts: list[str]) -> list[list[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.request_count += 1
+                return self.backend.embed(texts)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if self.debug_messages:
+                    print(f"Embedding request failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _embed(self, texts: list[str]) -> list[list[float]]:
+        size = self.backend.max_batch_size
+        embeddings = []
+        for start in range(0, len(texts), size):
+            embeddings.extend(self._request(texts[start:start + size]))
+        return embeddings
+
+    def _fetch(self, texts: list[str]) -> list[list[float]]:
+        if self.coalescer is not None:
+            return self.coalescer.submit(texts).result()
+        return self._embed(list(texts))
+
+    def get_embeddings(self, texts: list[str]) -> list[list[float]]:
+        """Embeddings for several texts, in order, using as few requests as possible"""
+        if self.cache is None:
+            return self._fetch(texts)
+
+        with self.cache_lock:
+            found = {t: self.cache.get(t) for t in dict.fromkeys(texts)}
+        missing = [t for t, vector in found.items() if vector is None]
+        if len(missing) > 0:
+            # round through the cache dtype so results don't depend on whether they were cached
+            vectors = np.asarray(self._fetch(missing), dtype=np.float32).astype(self.cache.dtype).astype(np.float32)
+            with self.cache_lock:
+                self.cache.put_many(missing, vectors)
+            found.update(zip(missing, vectors))
+        return [found[t].tolist() for t in texts]
+
+    def get_embedding(self, text: str) -> list[float]:
+        """Get embedding for a single text"""
+        return self.get_embeddings([text])[0]
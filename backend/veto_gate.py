@@ -0,0 +1,116 @@
+import threading
+from typing import Optional
+
+from database import Database
+from title_index import TitleIndex, TitleRegistry
+
+REPEAT_ADVICE = "Choose a subject mentioned in your article that is the least related to the current title and that is interesting."
+
+
+class VetoGate:
+    """
+    Decides the obvious cases before an article goes to Addison.
+
+    A title is vetoed on the spot if an existing or earlier vetoed title has
+    the same words (see title_key), or if its embedding is at least
+    `veto_similarity` close to one of theirs. A title whose nearest existing
+    and vetoed titles are all below `accept_similarity` is approved on the spot,
+    but only once Addison has approved at least `accept_rate` of the
+    `calibration` most recent such titles she saw herself. Addison also vetoes
+    for style, and this rate is how the gate learns whether she is still
+    doing that. Everything in between still goes to Addison, and so does
+    everything without an equivalent title when the database doesn't search
+    titles by meaning (see Database.has_title_vectors).
+    """
+
+    def __init__(self, database: Database, veto_similarity=0.95, accept_similarity=0.85, calibration=20,
+                 accept_rate=0.9):
+        self.database = database
+        self.veto_similarity = veto_similarity
+        self.accept_similarity = accept_similarity
+        self.calibration = calibration
+        self.accept_rate = accept_rate
+
+        self.vetoed = TitleRegistry()
+        self.vetoed_vectors = TitleIndex()
+        self.distant_verdicts: list[bool] = []  # Addison's approvals of the most recent distant titles
+        self.lock = threading.Lock()
+
+        self.auto_vetoes = 0  # titles
+        self.auto_accepts = 0
+        self.saved_calls = 0  # Addison calls, counted by the caller through count_call
+        self.addison_calls = 0
+
+    def nearest(self, embedding) -> tuple[Optional[str], float, bool]:
+        """The closest existing or vetoed title, its similarity and whether it was vetoed."""
+        with self.lock:
+            matches = [(t, s, True) for t, s in self.vetoed_vectors.vector_search(embedding, 1, min_similarity=-1.0)]
+        matches += [(t, s, False) for t, s in self.database.nearest_titles(embedding, 1)]
+        if len(matches) == 0:
+            return None, -1.0, False
+        return max(matches, key=lambda m: m[1])
+
+    @staticmethod
+    def veto(title: str, match: str, was_vetoed: bool) -> str:
+        reason = f"is too close to '{match}', which Addison already vetoed" if was_vetoed \
+            else f"is the same topic as the existing article '{match}'"
+        return f"Veto. '{title}' {reason}. {REPEAT_ADVICE}"
+
+    def check(self, title: str) -> tuple[Optional[str], Optional[float]]:
+        """
+        Addison-style feedback for a clear case, or None if Addison has to decide,
+        together with the similarity of the nearest known title (None if titles
+        have no embeddings).
+        """
+        existing = self.database.equivalent_title(title)
+        with self.lock:
+            vetoed = self.vetoed.equivalent(title)
+        if existing is not None or vetoed is not None:
+            self.auto_vetoes += 1
+            return self.veto(title, existing or vetoed, existing is None), 1.0
+        if not self.database.has_title_vectors:
+            # a missing match means nothing without a similarity search, so never approve on the spot
+            return None, None
+
+        embedding = self.database.vectorizer.get_embedding(title)
+        nearest, similarity, was_vetoed = self.nearest(embedding)
+        if similarity >= self.veto_similarity:
+            self.auto_vetoes += 1
+            return self.veto(title, nearest, was_vetoed), similarity
+
+        with self.lock:
+            calibrated = (len(self.distant_verdicts) >= self.calibration
+                          and sum(self.distant_verdicts) >= self.accept_rate * len(self.distant_verdicts))
+        if similarity < self.accept_similarity and calibrated:
+            self.auto_accepts += 1
+            return "Approval.", similarity
+
+        return None, similarity
+
+    def record(self, title: str, similarity: Optional[float], vetoed: bool):
+        """Learns from Addison's verdict on a title that `check` referred to her."""
+        embedding = None
+        if vetoed and similarity is not None:
+            embedding = self.database.vectorizer.get_embedding(title)
+        with self.lock:
+            if vetoed:
+                self.vetoed.add(title)
+            if embedding is not None:
+                self.vetoed_vectors.add(title, embedding)
+            if similarity is not None and similarity < self.accept_similarity:
+                self.distant_verdicts.append(not vetoed)
+                del self.distant_verdicts[:-self.calibration]
+
+    def count_call(self, saved: bool):
+        """
+        Counts one review: `saved` if the gate settled it without Addison. A
+        batch of titles only saves her call if none of them went to her.
+        """
+        if saved:
+            self.saved_calls += 1
+        else:
+            self.addison_calls += 1
+
+    def format_stats(self) -> str:
+        return (f"gate saved {self.saved_calls}/{self.saved_calls + self.addison_calls} Addison calls "
+                f"({self.auto_vetoes} titles vetoed, {self.auto_accepts} approved on the spot)")
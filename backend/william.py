@@ -1,10 +1,11 @@
-from typing import Optional
+from typing import List, Optional
 
 from database import Article
 from langchain.output_parsers import ResponseSchema, StructuredOutputParser
-from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages import HumanMessage, ToolMessage
 from langchain_openai import ChatOpenAI
-from prompts import WILLIAM_INIT_PROMPT, WILLIAM_WRITE_MORE_PROMPT
+from prompt_memory import PromptMemory, TokenCounter
+from prompts import WILLIAM_EXPAND_TITLE_PROMPT, WILLIAM_INIT_PROMPT, WILLIAM_PROPOSE_TITLES_PROMPT, WILLIAM_WRITE_MORE_PROMPT
 from pydantic import BaseModel, Field
 
 
@@ -15,11 +16,17 @@ class write_article(BaseModel):
     content: str = Field(..., description="body text of the article")
 
 
+class propose_titles(BaseModel):
+    """Propose candidate titles for the next Williampedia article"""
+
+    titles: List[str] = Field(..., description="candidate article titles, best first")
+
+
 class William:
-    def __init__(self, model_name="gpt-4o-mini", history_size=10, temperature=0.7):
+    def __init__(self, model_name="gpt-4o-mini", history_tokens=8000, temperature=0.7):
         super().__init__()
 
-        self.llm = ChatOpenAI(model=model_name, temperature=temperature)
+        llm = ChatOpenAI(model=model_name, temperature=temperature)
 
         self.response_schemas = [
             ResponseSchema(
@@ -31,13 +38,20 @@ class William:
             self.response_schemas
         )
 
-        self.history_size = history_size
-        self.message_history = []
+        self.history_tokens = history_tokens
+        self.prompt_memory = PromptMemory(WILLIAM_INIT_PROMPT, max_tokens=history_tokens,
+                                          counter=TokenCounter(model_name))
 
-        self.llm = self.llm.bind_tools([write_article], tool_choice="any")
+        self.llm = llm.bind_tools([write_article], tool_choice="any")
+        self.title_llm = llm.bind_tools([propose_titles], tool_choice="any")
 
     def produce_article(self, messages):
-        response = self.llm.invoke(messages)
+        return self.read_article(self.llm.invoke(messages))
+
+    async def aproduce_article(self, messages):
+        return self.read_article(await self.llm.ainvoke(messages))
+
+    def read_article(self, response):
         self.add_to_memory(response)
         tool_calls = response.tool_calls
         for call in tool_calls:
@@ -56,28 +70,54 @@ class William:
 
                 return article
 
-    def update_memory(self):
-        while len(self.message_history) > self.history_size:
-            self.message_history.pop(0)
+    @staticmethod
+    def read_titles(response) -> List[str]:
+        for call in response.tool_calls:
+            if call["name"] == "propose_titles":
+                return call["args"]["titles"]
+        return []
 
-        self.memory = [
-            SystemMessage(content=WILLIAM_INIT_PROMPT),
-            *self.message_history,
-        ]
+    def title_messages(self, n: int, rejected: Optional[str]):
+        # the proposals stay out of the history, only the approved title is written about there
+        return [*self.memory, HumanMessage(content=WILLIAM_PROPOSE_TITLES_PROMPT(n, rejected))]
+
+    @property
+    def memory(self):
+        return self.prompt_memory.messages()
 
     def add_to_memory(self, message):
-        self.message_history.append(message)
-        self.update_memory()
+        self.prompt_memory.add(message)
 
     def generate_new_article_prompt(self, feedback: str) -> str:
         return WILLIAM_WRITE_MORE_PROMPT(feedback)
 
-    def write_new_article(self, feedback: Optional[str]):
+    def prepare_memory(self, feedback: Optional[str]):
         # add prompt containing feedback and direction if we got feedback
         if feedback is not None:
             article_prompt = self.generate_new_article_prompt(feedback)
             self.add_to_memory(HumanMessage(content=article_prompt))
-        else:
-            self.update_memory()
 
+    def write_new_article(self, feedback: Optional[str]):
+        self.prepare_memory(feedback)
         return self.produce_article(self.memory)
+
+    async def awrite_new_article(self, feedback: Optional[str]):
+        self.prepare_memory(feedback)
+        return await self.aproduce_article(self.memory)
+
+    def propose_article_titles(self, feedback: Optional[str], n=3, rejected: Optional[str] = None) -> List[str]:
+        """`n` candidate titles for the next article, a much cheaper call than writing it."""
+        self.prepare_memory(feedback)
+        return self.read_titles(self.title_llm.invoke(self.title_messages(n, rejected)))[:n]
+
+    async def apropose_article_titles(self, feedback: Optional[str], n=3, rejected: Optional[str] = None) -> List[str]:
+        self.prepare_memory(feedback)
+        return self.read_titles(await self.title_llm.ainvoke(self.title_messages(n, rejected)))[:n]
+
+    def write_article_on(self, title: str):
+        self.add_to_memory(HumanMessage(content=WILLIAM_EXPAND_TITLE_PROMPT(title)))
+        return self.produce_article(self.memory)
+
+    async def awrite_article_on(self, title: str):
+        self.add_to_memory(HumanMessage(content=WILLIAM_EXPAND_TITLE_PROMPT(title)))
+        return await self.aproduce_article(self.memory)